@@ -5,8 +5,14 @@ Functions for grouping leads by assignee and creating optimal chunks for embeddi
 """
 
 import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import repeat
 from typing import List, Dict, Any, Optional, Tuple
-from flatten_utils import flattenLeadToText
+from flatten_utils import flattenLeadToText, leads_to_columns, flatten_lead_columns
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +20,109 @@ logger = logging.getLogger(__name__)
 OPTIMAL_CHUNK_SIZE_MIN = 2000  # 2KB
 OPTIMAL_CHUNK_SIZE_MAX = 5000  # 5KB
 
+# Below this many leads the IPC/pickling overhead outweighs the process pool speedup
+PARALLEL_FLATTEN_THRESHOLD = 500
+
+# Start method for the flattening workers: never fork the multi-threaded server process
+# (a fork can inherit a lock held by another thread, e.g. logging's, and deadlock)
+_FLATTEN_START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+# Process pool for CPU-bound lead flattening, created on first large batch
+_flatten_executor: Optional[ProcessPoolExecutor] = None
+# Guards the pool, which is created and reset from the server's worker threads
+_flatten_executor_lock = threading.Lock()
+
+def _get_flatten_executor() -> ProcessPoolExecutor:
+    """Return the shared process pool used for flattening, creating it if needed."""
+    global _flatten_executor
+    with _flatten_executor_lock:
+        if _flatten_executor is None:
+            _flatten_executor = ProcessPoolExecutor(
+                max_workers=os.cpu_count(),
+                mp_context=multiprocessing.get_context(_FLATTEN_START_METHOD)
+            )
+        return _flatten_executor
+
+def _reset_flatten_executor(executor: ProcessPoolExecutor) -> None:
+    """Drop a broken process pool so the next large batch starts a fresh one."""
+    global _flatten_executor
+    with _flatten_executor_lock:
+        if _flatten_executor is executor:
+            _flatten_executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+def _flatten_lead_safe(lead: Dict[str, Any], company_name: str) -> Optional[str]:
+    """Flatten a single lead, returning None instead of raising on bad data."""
+    try:
+        return flattenLeadToText(lead, company_name)
+    except Exception as e:
+        logger.warning(f"Error flattening lead {lead.get('id', 'unknown')}: {e}")
+        return None
+
+def _flatten_lead_batch(leads: List[Dict[str, Any]], company_name: str) -> List[Optional[str]]:
+    """Flatten a batch of leads column-wise, falling back to per-lead flattening on error."""
+    try:
+        return flatten_lead_columns(leads_to_columns(leads), company_name)
+    except Exception as e:
+        logger.warning(f"Batch flattening failed, retrying lead by lead: {e}")
+        return [_flatten_lead_safe(lead, company_name) for lead in leads]
+
+def _flatten_column_batch(columns: Dict[str, List[Any]], company_name: str) -> List[Optional[str]]:
+    """Flatten a column slice (see leads_to_columns) in a pool worker, row by row if the batch fails."""
+    try:
+        return flatten_lead_columns(columns, company_name)
+    except Exception as e:
+        logger.warning(f"Batch flattening failed, retrying lead by lead: {e}")
+    
+    lead_texts = []
+    for i, lead_id in enumerate(columns["id"]):
+        try:
+            row = {field_path: [values[i]] for field_path, values in columns.items()}
+            lead_texts.append(flatten_lead_columns(row, company_name)[0])
+        except Exception as e:
+            logger.warning(f"Error flattening lead {lead_id}: {e}")
+            lead_texts.append(None)
+    return lead_texts
+
+def flatten_leads(leads: List[Dict[str, Any]], company_name: str) -> List[Optional[str]]:
+    """
+    Flatten leads to text, spreading the work across processes for large batches.
+    
+    Workers only receive the extracted field columns, never the raw lead dicts,
+    which can hold values that cannot be pickled (e.g. Firestore references).
+    If the pool cannot take the work for any reason, the leads are flattened
+    in-process instead.
+    
+    Args:
+        leads: List of lead dictionaries
+        company_name: Company name
+        
+    Returns:
+        List[Optional[str]]: Flattened text per lead (same order), None where flattening failed
+    """
+    if len(leads) < PARALLEL_FLATTEN_THRESHOLD:
+        return _flatten_lead_batch(leads, company_name)
+    
+    # Hand each worker the columns of a contiguous slice so it can flatten column-wise
+    workers = os.cpu_count() or 1
+    slice_size = max(1, -(-len(leads) // (workers * 4)))
+    column_slices = [leads_to_columns(leads[i:i + slice_size]) for i in range(0, len(leads), slice_size)]
+    logger.info(f"Flattening {len(leads)} leads across {workers} processes")
+    
+    executor = None
+    try:
+        executor = _get_flatten_executor()
+        lead_texts = []
+        for slice_texts in executor.map(_flatten_column_batch, column_slices, repeat(company_name)):
+            lead_texts.extend(slice_texts)
+        return lead_texts
+    except Exception as e:
+        # Pickling errors, a dead worker or a pool that cannot start must not fail the ingest
+        logger.warning(f"Parallel flattening failed, flattening in-process instead: {e}")
+        if isinstance(e, BrokenProcessPool):
+            _reset_flatten_executor(executor)
+        return _flatten_lead_batch(leads, company_name)
+
 def group_leads_by_assignee(leads: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
     """
     Group leads by assignedTo field.
@@ -53,7 +162,12 @@ def group_leads_by_assignee(leads: List[Dict[str, Any]]) -> Dict[str, List[Dict[
     
     return grouped_leads
 
-def create_rich_text_block(leads: List[Dict[str, Any]], company_name: str, assignee: str) -> str:
+def create_rich_text_block(
+    leads: List[Dict[str, Any]], 
+    company_name: str, 
+    assignee: str,
+    lead_texts: Optional[List[Optional[str]]] = None
+) -> str:
     """
     Create a rich text block from multiple leads for a single assignee.
     
@@ -61,6 +175,7 @@ def create_rich_text_block(leads: List[Dict[str, Any]], company_name: str, assig
         leads: List of leads for this assignee
         company_name: Company name
         assignee: Assignee name
+        lead_texts: Optional pre-flattened text per lead (None entries mark failures)
         
     Returns:
         str: Rich text block containing all leads information
@@ -71,18 +186,16 @@ def create_rich_text_block(leads: List[Dict[str, Any]], company_name: str, assig
         "=" * 50
     ]
     
-    for i, lead in enumerate(leads, 1):
-        try:
-            # Get the flattened lead text
-            lead_text = flattenLeadToText(lead, company_name)
-            
+    if lead_texts is None:
+        lead_texts = flatten_leads(leads, company_name)
+    
+    for i, (lead, lead_text) in enumerate(zip(leads, lead_texts), 1):
+        if lead_text is not None:
             # Add lead header with number
             text_parts.append(f"\nLead #{i}:")
             text_parts.append(lead_text)
             text_parts.append("-" * 30)
-            
-        except Exception as e:
-            logger.warning(f"Error flattening lead {lead.get('id', 'unknown')}: {e}")
+        else:
             # Add basic info as fallback
             text_parts.append(f"\nLead #{i}: {lead.get('id', 'unknown')} (processing error)")
             text_parts.append("-" * 30)
@@ -257,10 +370,18 @@ def create_chunked_documents(
     """
     documents = []
     
+    # Flatten every lead in one pass so large batches can use the process pool
+    all_leads = [lead for leads in grouped_leads.values() for lead in leads]
+    all_lead_texts = flatten_leads(all_leads, company_name)
+    offset = 0
+    
     for assignee, leads in grouped_leads.items():
+        lead_texts = all_lead_texts[offset:offset + len(leads)]
+        offset += len(leads)
+        
         try:
             # Create rich text block for this assignee
-            rich_text = create_rich_text_block(leads, company_name, assignee)
+            rich_text = create_rich_text_block(leads, company_name, assignee, lead_texts)
             
             # Split into optimal chunks
             chunks = split_text_into_chunks(rich_text)
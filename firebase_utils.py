@@ -6,6 +6,7 @@ Provides Firebase initialization and lead fetching functionality.
 
 import json
 import logging
+import threading
 from typing import List, Dict, Any
 from pathlib import Path
 import firebase_admin
@@ -15,6 +16,8 @@ logger = logging.getLogger(__name__)
 
 # Global registry to track initialized Firebase apps
 _firebase_apps: Dict[str, firebase_admin.App] = {}
+# Guards the registry when apps are initialized from worker threads
+_firebase_apps_lock = threading.Lock()
 
 def init_firebase_app(company_name: str) -> firebase_admin.App:
     """
@@ -34,6 +37,15 @@ def init_firebase_app(company_name: str) -> firebase_admin.App:
     if company_name in _firebase_apps:
         return _firebase_apps[company_name]
     
+    with _firebase_apps_lock:
+        # Another thread may have initialized it while we waited for the lock
+        if company_name in _firebase_apps:
+            return _firebase_apps[company_name]
+        
+        return _initialize_firebase_app(company_name)
+
+def _initialize_firebase_app(company_name: str) -> firebase_admin.App:
+    """Create and register the Firebase app for a company (caller holds the registry lock)."""
     # Get service account file path
     firebase_config_dir = Path(__file__).parent / "firebase_config"
     service_account_path = firebase_config_dir / f"{company_name}.json"
@@ -4,23 +4,29 @@ FastAPI application for semantic RAG pipeline with lead processing.
 Provides exactly two endpoints: /update-leads and /ask.
 """
 
+import asyncio
 import logging
 import os
+import time
 from typing import List, Dict, Any, Optional
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel, Field
 import uvicorn
-from openai import OpenAI
+from openai import RateLimitError
 
 # Import our utility modules
 from firebase_utils import init_firebase_app, fetch_all_leads
 from chunking_utils import group_leads_by_assignee, create_chunked_documents
 from vectorstore_utils import (
+    get_openai_client,
+    get_retry_after_seconds,
     getVectorStoreName, 
-    upsert_chunked_documents,
+    upsert_chunked_documents_async,
     delete_vectors_by_filter,
-    search_vector_store
+    search_vector_store,
+    find_vector_store
 )
 from dotenv import load_dotenv
 
@@ -30,12 +36,69 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client with graceful handling
-try:
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-except Exception as e:
-    logger.warning(f"OpenAI client initialization warning: {e}")
-    client = None
+# Consecutive GPT-4o failures before /ask routes straight to the fallback model
+PRIMARY_MODEL_FAIL_MAX = 5
+# Seconds to skip GPT-4o once its circuit opens
+PRIMARY_MODEL_RESET_TIMEOUT = 30
+
+class ModelCircuitBreaker:
+    """
+    Circuit breaker for the primary chat model.
+    
+    Opens after fail_max consecutive failures (or immediately on a rate limit,
+    honouring Retry-After) so requests skip the failing model until reset_timeout
+    elapses. The first request after that is a trial call that closes the circuit
+    on success or re-opens it on failure; other requests skip the model while the
+    trial is in flight (or until reset_timeout, should the trial never report back).
+    """
+    
+    def __init__(self, name: str, fail_max: int, reset_timeout: float):
+        self.name = name
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial_until = 0.0
+    
+    def allow_request(self) -> bool:
+        """Return True if the primary model should be tried for this request."""
+        now = time.monotonic()
+        if now < self.open_until:
+            return False
+        
+        if self.open_until:
+            # Cooldown over: let a single trial call through
+            if now < self.trial_until:
+                return False
+            self.trial_until = now + self.reset_timeout
+        return True
+    
+    def record_success(self) -> None:
+        """Close the circuit after a successful call."""
+        if self.failures:
+            logger.info(f"Circuit breaker for {self.name} closed after recovery")
+        self.failures = 0
+        self.open_until = 0.0
+        self.trial_until = 0.0
+    
+    def record_failure(self, retry_after: Optional[float] = None) -> None:
+        """Count a failed call and open the circuit if the threshold (or a rate limit) is hit, or a trial call failed."""
+        self.failures += 1
+        self.trial_until = 0.0
+        
+        if retry_after is not None or self.failures >= self.fail_max or self.open_until:
+            cooldown = max(self.reset_timeout, retry_after or 0.0)
+            self.open_until = time.monotonic() + cooldown
+            logger.warning(
+                f"Circuit breaker for {self.name} opened for {cooldown:.0f}s "
+                f"after {self.failures} consecutive failure(s)"
+            )
+
+primary_model_breaker = ModelCircuitBreaker(
+    "gpt-4o",
+    fail_max=PRIMARY_MODEL_FAIL_MAX,
+    reset_timeout=PRIMARY_MODEL_RESET_TIMEOUT
+)
 
 # Pydantic models for request/response
 class UpdateLeadsRequest(BaseModel):
@@ -62,13 +125,35 @@ class AskResponse(BaseModel):
     answer: str
     sources: List[Dict[str, Any]]
 
+# Static sections of the RAG prompt; only the question and retrieved documents vary per request
+_RAG_PROMPT_PREFIX = "You are a sales analyst working with grouped lead data. User question: "
+_RAG_PROMPT_MID = """
+
+Here are the top relevant lead portfolios (each document contains multiple leads grouped by assignee):
+
+"""
+_RAG_PROMPT_SUFFIX = """
+
+Please answer the user's question concisely and include numeric comparisons (e.g., % change, counts) where applicable. If specific data is missing, say so clearly. 
+
+Structure your response with these sections when relevant:
+- Lead Volume & Trends (by assignee)
+- Engagement & Follow-ups  
+- Source & Quality
+- Stakeholder Activity
+- Smart Observations
+- Final Summary with actionable recommendations
+
+Focus on being analytical and data-driven in your response. Note that each document represents a portfolio of leads for a specific assignee."""
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Semantic RAG Pipeline API",
     description="API for lead processing and semantic question answering",
     version="1.0.0",
     docs_url="/docs",
-    redoc_url="/redoc"
+    redoc_url="/redoc",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -104,11 +189,14 @@ async def update_leads(request: UpdateLeadsRequest):
     try:
         logger.info(f"Processing update-leads request for company: {request.companyName}")
         
+        # Blocking Firestore and CPU-bound chunking steps run in worker threads
+        # so the event loop keeps serving other requests during ingestion
+        
         # Step 1: Initialize Firebase app
-        init_firebase_app(request.companyName)
+        await asyncio.to_thread(init_firebase_app, request.companyName)
         
         # Step 2: Fetch all leads
-        leads = fetch_all_leads(request.companyName)
+        leads = await asyncio.to_thread(fetch_all_leads, request.companyName)
         total_leads_fetched = len(leads)
         
         logger.info(f"Fetched {total_leads_fetched} leads for {request.companyName}")
@@ -146,7 +234,9 @@ async def update_leads(request: UpdateLeadsRequest):
         grouped_leads = group_leads_by_assignee(leads)
         
         # Step 5: Create chunked documents for each assignee group
-        chunked_documents = create_chunked_documents(grouped_leads, request.companyName)
+        chunked_documents = await asyncio.to_thread(
+            create_chunked_documents, grouped_leads, request.companyName
+        )
         
         # Create assignee breakdown
         assignee_breakdown = {}
@@ -156,7 +246,7 @@ async def update_leads(request: UpdateLeadsRequest):
         # Step 6: Upsert chunked documents to vector store
         total_documents_created = 0
         if chunked_documents:
-            upsert_result = upsert_chunked_documents(request.companyName, chunked_documents)
+            upsert_result = await upsert_chunked_documents_async(request.companyName, chunked_documents)
             total_documents_created = upsert_result.get('upserted', 0)
             logger.info(f"Upserted {total_documents_created} chunked documents to vector store")
         
@@ -182,17 +272,15 @@ async def ask_question(request: AskRequest):
     Retrieve top 10 semantically relevant lead docs and answer using GPT-4o (RAG).
     
     Steps:
-    1. Get vector store name for the company
-    2. Search vector store for semantically similar documents
-    3. Build RAG prompt with retrieved documents
-    4. Call GPT-4o with the RAG prompt
-    5. Return answer and sources
+    1. Search the company's vector store for semantically similar documents
+    2. Build RAG prompt with retrieved documents
+    3. Call GPT-4o with the RAG prompt
+    4. Return answer and sources
     """
     try:
         logger.info(f"Processing ask request for company: {request.companyName}")
         
-        # Step 1 & 2: Search vector store
-        vector_store_name = getVectorStoreName(request.companyName)
+        # Step 1: Search vector store
         search_results = search_vector_store(request.companyName, request.question, top_k=20)
         
         if not search_results:
@@ -202,7 +290,7 @@ async def ask_question(request: AskRequest):
                 sources=[]
             )
         
-        # Step 3: Build RAG prompt
+        # Step 2: Build RAG prompt
         docs_context = []
         sources = []
         
@@ -228,48 +316,49 @@ async def ask_question(request: AskRequest):
                 "snippet": content[:300] + "..." if len(content) > 300 else content
             })
         
-        rag_prompt = f"""You are a sales analyst working with grouped lead data. User question: {request.question}
-
-Here are the top relevant lead portfolios (each document contains multiple leads grouped by assignee):
-
-{''.join(docs_context)}
-
-Please answer the user's question concisely and include numeric comparisons (e.g., % change, counts) where applicable. If specific data is missing, say so clearly. 
-
-Structure your response with these sections when relevant:
-- Lead Volume & Trends (by assignee)
-- Engagement & Follow-ups  
-- Source & Quality
-- Stakeholder Activity
-- Smart Observations
-- Final Summary with actionable recommendations
-
-Focus on being analytical and data-driven in your response. Note that each document represents a portfolio of leads for a specific assignee."""
+        rag_prompt = "".join((
+            _RAG_PROMPT_PREFIX,
+            request.question,
+            _RAG_PROMPT_MID,
+            "".join(docs_context),
+            _RAG_PROMPT_SUFFIX
+        ))
         
-        # Step 4: Call GPT-4o
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[
-                    {"role": "system", "content": "You are a helpful sales analyst assistant."},
-                    {"role": "user", "content": rag_prompt}
-                ],
-                temperature=0.3,  # Lower temperature for more consistent analytical responses
-                max_tokens=1500
-            )
-            
-            answer = response.choices[0].message.content
-            
-        except Exception as e:
-            logger.error(f"Error calling GPT-4o: {e}")
-            # Fallback to GPT-3.5-turbo if GPT-4o fails
+        # Step 3: Call GPT-4o, going straight to GPT-3.5-turbo while its circuit is open
+        messages = [
+            {"role": "system", "content": "You are a helpful sales analyst assistant."},
+            {"role": "user", "content": rag_prompt}
+        ]
+        answered = False
+        
+        if primary_model_breaker.allow_request():
             try:
-                response = client.chat.completions.create(
+                response = get_openai_client().chat.completions.create(
+                    model="gpt-4o",
+                    messages=messages,
+                    temperature=0.3,  # Lower temperature for more consistent analytical responses
+                    max_tokens=1500
+                )
+                
+                answer = response.choices[0].message.content
+                answered = True
+                primary_model_breaker.record_success()
+                
+            except RateLimitError as e:
+                logger.error(f"GPT-4o rate limited: {e}")
+                primary_model_breaker.record_failure(retry_after=get_retry_after_seconds(e))
+            except Exception as e:
+                logger.error(f"Error calling GPT-4o: {e}")
+                primary_model_breaker.record_failure()
+        else:
+            logger.info("GPT-4o circuit is open, using gpt-3.5-turbo directly")
+        
+        if not answered:
+            # Fallback to GPT-3.5-turbo if GPT-4o fails or is circuit-broken
+            try:
+                response = get_openai_client().chat.completions.create(
                     model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are a helpful sales analyst assistant."},
-                        {"role": "user", "content": rag_prompt}
-                    ],
+                    messages=messages,
                     temperature=0.3,
                     max_tokens=1500
                 )
@@ -278,7 +367,7 @@ Focus on being analytical and data-driven in your response. Note that each docum
                 logger.error(f"Error with fallback model: {fallback_e}")
                 raise HTTPException(status_code=500, detail="Error generating response from AI model")
         
-        # Step 5: Return response
+        # Step 4: Return response
         return AskResponse(
             answer=answer,
             sources=sources
@@ -308,18 +397,10 @@ async def health_check():
 async def vector_store_status(company_name: str):
     """Check if vector store exists and has data for a company."""
     try:
-        from vectorstore_utils import getVectorStoreName
-        
         vector_store_name = getVectorStoreName(company_name)
         
-        # Find vector store
-        vector_stores = client.beta.vector_stores.list()
-        target_store = None
-        
-        for store in vector_stores.data:
-            if store.name == vector_store_name:
-                target_store = store
-                break
+        # Find vector store (uncached, so the status reflects live file counts)
+        target_store = await asyncio.to_thread(find_vector_store, vector_store_name)
         
         if not target_store:
             return {
@@ -329,18 +410,15 @@ async def vector_store_status(company_name: str):
                 "status": "no_data"
             }
         
-        # Get file count
-        vector_store_files = client.beta.vector_stores.files.list(
-            vector_store_id=target_store.id,
-            limit=100
-        )
+        # The listed store already carries its file counts, so no file listing is needed
+        file_count = target_store.file_counts.total
         
         return {
             "company": company_name,
             "vector_store_exists": True,
             "vector_store_id": target_store.id,
-            "file_count": len(vector_store_files.data),
-            "status": "ready" if len(vector_store_files.data) > 0 else "empty"
+            "file_count": file_count,
+            "status": "ready" if file_count > 0 else "empty"
         }
         
     except Exception as e:
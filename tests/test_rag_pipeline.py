@@ -4,22 +4,38 @@ Unit tests for the semantic RAG pipeline modules.
 """
 
 import unittest
+import hashlib
 import os
+import re
+import tempfile
+import threading
 from datetime import datetime
+from pathlib import Path
+from concurrent.futures.process import BrokenProcessPool
+from unittest import mock
+
+import httpx
 
 # Set a test API key to avoid initialization errors
 os.environ["OPENAI_API_KEY"] = "test-key-for-testing"
 
-from flatten_utils import flattenLeadToText
-from vectorstore_utils import getVectorStoreName
+from flatten_utils import flattenLeadToText, leads_to_columns, flatten_lead_columns
+import chunking_utils
+from chunking_utils import flatten_leads, PARALLEL_FLATTEN_THRESHOLD
+import main
+import vectorstore_utils
+from vectorstore_utils import getVectorStoreName, load_file_cache, save_file_cache
 
-class TestFlattenUtils(unittest.TestCase):
-    """Test cases for flatten_utils module."""
-    
-    def test_flattenLeadToText_basic(self):
-        """Test basic lead flattening functionality."""
-        # Sample lead data
-        lead = {
+TEST_COMPANY_NAME = "TestCompany"
+EXPECTED_HEADER = f"Lead from {TEST_COMPANY_NAME}"
+# Every flattened lead opens with the company header and lead id and ends with a period
+EXPECTED_LEAD_PATTERN = re.compile(rf"^{EXPECTED_HEADER}: id=\w+\..*\.$", re.DOTALL)
+
+# Flatten cases: (name, lead, substrings that must appear, substrings that must not)
+FLATTEN_CASES = [
+    (
+        "basic",
+        {
             "id": "LEAD123",
             "generatedAt": "2024-01-15",
             "projectName": "New Office Building",
@@ -37,22 +53,19 @@ class TestFlattenUtils(unittest.TestCase):
             "updatedAt": "2024-01-21T10:30:00Z",
             "assignedTo": "Sales Manager",
             "assignedToId": "SM001"
-        }
-        
-        company_name = "TestCompany"
-        result = flattenLeadToText(lead, company_name)
-        
-        # Verify the result contains expected elements
-        self.assertIn(f"Lead from {company_name}", result)
-        self.assertIn("id=LEAD123", result)
-        self.assertIn("Project: New Office Building", result)
-        self.assertIn("City: Mumbai", result)
-        self.assertIn("Client: John Doe Construction", result)
-        self.assertIn("Phone: +91-9876543210", result)
-        
-    def test_flattenLeadToText_missing_fields(self):
-        """Test flattening with missing or empty fields."""
-        lead = {
+        },
+        [
+            "id=LEAD123",
+            "Project: New Office Building",
+            "City: Mumbai",
+            "Client: John Doe Construction",
+            "Phone: +91-9876543210"
+        ],
+        []
+    ),
+    (
+        "missing_fields",
+        {
             "id": "LEAD456",
             "projectName": "Small Renovation",
             "clientDetails": {
@@ -62,25 +75,14 @@ class TestFlattenUtils(unittest.TestCase):
             "projectCity": None,  # Null city
             "lastDiscussion": "--select--",  # Placeholder value
             "updatedAt": "2024-01-21"
-        }
-        
-        company_name = "TestCompany"
-        result = flattenLeadToText(lead, company_name)
-        
-        # Should contain basic info
-        self.assertIn("Lead from TestCompany", result)
-        self.assertIn("id=LEAD456", result)
-        self.assertIn("Project: Small Renovation", result)
-        self.assertIn("Client: Jane Smith", result)
-        
+        },
+        ["id=LEAD456", "Project: Small Renovation", "Client: Jane Smith"],
         # Should not contain empty/placeholder values
-        self.assertNotIn("Phone:", result)
-        self.assertNotIn("City:", result)
-        self.assertNotIn("--select--", result)
-        
-    def test_flattenLeadToText_nested_client_details(self):
-        """Test extraction of nested client details."""
-        lead = {
+        ["Phone:", "City:", "--select--"]
+    ),
+    (
+        "nested_client_details",
+        {
             "id": "LEAD789",
             "clientDetails": {
                 "name": "ABC Corporation",
@@ -88,55 +90,513 @@ class TestFlattenUtils(unittest.TestCase):
                 "email": "contact@abc.com"  # Email not in our extraction list
             },
             "projectCategory": "Residential"
-        }
+        },
+        ["Client: ABC Corporation", "Phone: +91-1234567890", "Category: Residential"],
+        # Email should not be included as it's not in our fields list
+        ["contact@abc.com"]
+    ),
+]
+
+# Leads shared by the integration tests
+SAMPLE_LEADS = [
+    {
+        "id": "LEAD001",
+        "projectName": "Office Complex",
+        "clientDetails": {"name": "Client A", "phoneNumber": "+91-1111111111"},
+        "assignedTo": "Manager A",
+        "assignedToId": "MGA001",
+        "updatedAt": "2024-01-15T10:00:00Z"
+    },
+    {
+        "id": "LEAD002", 
+        "projectName": "Residential Tower",
+        "clientDetails": {"name": "Client B", "phoneNumber": "+91-2222222222"},
+        "assignedTo": "Manager B",
+        "assignedToId": "MGB001",
+        "updatedAt": "2024-01-16T11:00:00Z"
+    }
+]
+
+class TestFlattenUtils(unittest.TestCase):
+    """Test cases for flatten_utils module."""
+    
+    def test_flattenLeadToText_cases(self):
+        """Test lead flattening against the shared FLATTEN_CASES table."""
+        for case_name, lead, expected_substrings, unexpected_substrings in FLATTEN_CASES:
+            with self.subTest(case_name):
+                result = flattenLeadToText(lead, TEST_COMPANY_NAME)
+                
+                self.assertRegex(result, EXPECTED_LEAD_PATTERN)
+                for substring in expected_substrings:
+                    self.assertIn(substring, result)
+                for substring in unexpected_substrings:
+                    self.assertNotIn(substring, result)
         
-        company_name = "TestCompany"
-        result = flattenLeadToText(lead, company_name)
+    def test_flatten_lead_columns_matches_single_lead(self):
+        """Test that columnar batch flattening matches flattening each lead on its own."""
+        leads = [
+            {
+                "id": "LEAD001",
+                "projectName": "Office Complex",
+                "clientDetails": {"name": "Client A", "phoneNumber": "+91-1111111111"},
+                "lastDiscussion": "Shared quotation",
+                "nextFollowUpDate": "2024-02-01"
+            },
+            {
+                "projectCity": "N/A",
+                "clientDetails": None,
+                "updatedAt": datetime(2024, 1, 16, 11, 0)
+            }
+        ]
         
-        self.assertIn("Client: ABC Corporation", result)
-        self.assertIn("Phone: +91-1234567890", result)
-        self.assertIn("Category: Residential", result)
-        # Email should not be included as it's not in our fields list
-        self.assertNotIn("contact@abc.com", result)
+        columns = leads_to_columns(leads)
+        self.assertEqual(columns["clientDetails.name"], ["Client A", None])
+        self.assertEqual(columns["id"], ["LEAD001", "unknown"])
+        
+        expected = [flattenLeadToText(lead, TEST_COMPANY_NAME) for lead in leads]
+        self.assertEqual(flatten_lead_columns(columns, TEST_COMPANY_NAME), expected)
+        self.assertIn("Updated: January 16, 2024", expected[1])
+
+class TestChunkingUtils(unittest.TestCase):
+    """Test cases for chunking_utils module."""
+    
+    def test_flatten_leads_matches_serial_flatten(self):
+        """Test that batch flattening (including the process pool path) preserves order and output."""
+        leads = [
+            {"id": f"LEAD{i}", "projectName": f"Project {i}", "projectCity": "Pune"}
+            for i in range(PARALLEL_FLATTEN_THRESHOLD + 10)
+        ]
+        
+        expected = [flattenLeadToText(lead, TEST_COMPANY_NAME) for lead in leads]
+        
+        self.assertEqual(flatten_leads(leads[:5], TEST_COMPANY_NAME), expected[:5])
+        self.assertEqual(flatten_leads(leads, TEST_COMPANY_NAME), expected)
+        
+    def test_flatten_leads_recovers_from_broken_pool(self):
+        """Test that a broken process pool is discarded and the batch is flattened in-process."""
+        leads = [{"id": f"LEAD{i}", "projectName": f"Project {i}"} for i in range(PARALLEL_FLATTEN_THRESHOLD)]
+        broken_executor = mock.Mock()
+        broken_executor.map.side_effect = BrokenProcessPool("worker died")
+        
+        with mock.patch.object(chunking_utils, "_flatten_executor", broken_executor):
+            lead_texts = flatten_leads(leads, TEST_COMPANY_NAME)
+            self.assertIsNone(chunking_utils._flatten_executor)
+        
+        self.assertEqual(lead_texts, [flattenLeadToText(lead, TEST_COMPANY_NAME) for lead in leads])
+        broken_executor.shutdown.assert_called_once()
+        
+    def test_flatten_leads_with_unpicklable_lead_values(self):
+        """Test that lead values that cannot be pickled never fail parallel flattening."""
+        leads = [
+            {"id": f"LEAD{i}", "projectName": f"Project {i}", "clientRef": threading.Lock()}
+            for i in range(PARALLEL_FLATTEN_THRESHOLD)
+        ]
+        expected = [flattenLeadToText(lead, TEST_COMPANY_NAME) for lead in leads]
+        
+        # Fields the flattener does not extract are never sent to the workers
+        self.assertEqual(flatten_leads(leads, TEST_COMPANY_NAME), expected)
+        
+        # An unpicklable extracted field falls back to in-process flattening
+        leads[0]["projectCity"] = threading.Lock()
+        expected[0] = flattenLeadToText(leads[0], TEST_COMPANY_NAME)
+        self.assertEqual(flatten_leads(leads, TEST_COMPANY_NAME), expected)
 
 class TestVectorStoreUtils(unittest.TestCase):
     """Test cases for vectorstore_utils module."""
     
+    def setUp(self):
+        """Point the on-disk cache at a temporary database, as seen by a fresh process, for each test."""
+        tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp_dir.cleanup)
+        cache_path = mock.patch.object(vectorstore_utils, "FILE_CACHE_PATH", Path(tmp_dir.name) / "cache.sqlite")
+        cache_path.start()
+        self.addCleanup(cache_path.stop)
+        persisted_id_names = mock.patch.object(vectorstore_utils, "_persisted_id_names", set())
+        persisted_id_names.start()
+        self.addCleanup(persisted_id_names.stop)
+    
     def test_getVectorStoreName(self):
         """Test vector store name generation."""
         self.assertEqual(getVectorStoreName("TechCorp"), "techcorp_leads")
         self.assertEqual(getVectorStoreName("Finance-First"), "finance-first_leads")
         self.assertEqual(getVectorStoreName("KALCO"), "kalco_leads")
+        
+    def test_missing_api_key_fails_before_building_http_client(self):
+        """Test that a missing OPENAI_API_KEY raises without creating (and leaking) an HTTP client."""
+        with mock.patch.dict(os.environ, {"OPENAI_API_KEY": ""}), \
+             mock.patch.object(vectorstore_utils, "client", None), \
+             mock.patch.object(vectorstore_utils, "build_openai_http_client") as build_http_client:
+            with self.assertRaises(vectorstore_utils.OpenAIError):
+                vectorstore_utils.get_openai_client()
+            build_http_client.assert_not_called()
+        
+    def test_file_cache_round_trip(self):
+        """Test that the upload cache is replaced per company and isolated between companies."""
+        save_file_cache("TechCorp", {"doc_0": ("hash0", "file-0"), "doc_1": ("hash1", "file-1")})
+        save_file_cache("KALCO", {"doc_0": ("hashK", "file-K")})
+        save_file_cache("TechCorp", {"doc_1": ("hash1b", "file-2")})
+        
+        self.assertEqual(load_file_cache("TechCorp"), {"doc_1": ("hash1b", "file-2")})
+        self.assertEqual(load_file_cache("KALCO"), {"doc_0": ("hashK", "file-K")})
+        self.assertEqual(load_file_cache("Unknown"), {})
+        
+    def test_file_cache_errors_are_not_fatal(self):
+        """Test that an unopenable cache database reads as empty and ignores writes."""
+        unopenable_path = Path(vectorstore_utils.FILE_CACHE_PATH).parent / "missing" / "cache.sqlite"
+        with mock.patch.object(vectorstore_utils, "FILE_CACHE_PATH", unopenable_path):
+            save_file_cache("TechCorp", {"doc_0": ("hash0", "file-0")})
+            self.assertEqual(load_file_cache("TechCorp"), {})
+
+    def test_pack_embedding_batches(self):
+        """Test that embedding batches respect both the item cap and the token budget."""
+        self.assertEqual(vectorstore_utils._pack_embedding_batches([1, 1, 1, 1, 1], 2, 10), [(0, 2), (2, 4), (4, 5)])
+        # An oversized text is sent on its own rather than dropped
+        self.assertEqual(vectorstore_utils._pack_embedding_batches([3, 3, 5, 20, 1], 10, 6), [(0, 2), (2, 3), (3, 4), (4, 5)])
+        self.assertEqual(vectorstore_utils._pack_embedding_batches([], 64), [])
+        
+    def test_token_count_falls_back_when_encoding_cannot_load(self):
+        """Test that a failed tiktoken encoding download falls back to the estimate."""
+        fake_tiktoken = mock.Mock()
+        fake_tiktoken.encoding_for_model.side_effect = OSError("no network")
+        vectorstore_utils._get_embedding_encoding.cache_clear()
+        self.addCleanup(vectorstore_utils._get_embedding_encoding.cache_clear)
+        
+        with mock.patch.object(vectorstore_utils, "tiktoken", fake_tiktoken):
+            self.assertEqual(vectorstore_utils._count_tokens(["abcdefgh"]), [3])
+        
+    def test_token_estimate_errs_high_for_non_latin_text(self):
+        """Test that the tiktoken-free estimate counts non-ASCII text by UTF-8 bytes, not characters."""
+        self.assertEqual(vectorstore_utils._estimate_tokens("abcdefgh"), 3)
+        self.assertEqual(vectorstore_utils._estimate_tokens("मुंबई"), len("मुंबई".encode("utf-8")) + 1)
+        
+    def test_document_batches_share_attributes(self):
+        """Test that file batches close at the size limit and at every assignee boundary."""
+        def doc(assignee, index):
+            return {"id": f"{assignee}_{index}", "text": "", "metadata": {"assignedTo": assignee, "chunk_index": index}}
+        
+        documents = [doc("Asha", 0), doc("Asha", 1), doc("Asha", 2), doc("Ravi", 0)]
+        batches = vectorstore_utils._split_document_batches(documents, 2)
+        self.assertEqual([[d["id"] for d in batch] for batch in batches], [["Asha_0", "Asha_1"], ["Asha_2"], ["Ravi_0"]])
+        self.assertEqual(vectorstore_utils._document_attributes(documents[3]), {"assignedTo": "Ravi"})
+        
+    def test_filtered_delete_detaches_matching_files(self):
+        """Test that filtered deletion detaches only the files tagged with the assignee."""
+        fake_client = mock.Mock()
+        fake_client.vector_stores.files.list.return_value = [
+            mock.Mock(id="file-1", attributes={"assignedTo": "Asha", "assignedToId": "u1"}),
+            mock.Mock(id="file-2", attributes={"assignedTo": "Ravi", "assignedToId": "u2"}),
+            mock.Mock(id="file-3", attributes=None),
+        ]
+        
+        with mock.patch.object(vectorstore_utils, "client", fake_client), \
+             mock.patch.object(vectorstore_utils, "_get_vector_store_id", return_value="vs_1"):
+            result = vectorstore_utils.delete_vectors_by_filter("TechCorp", assigned_to_id="u1")
+        
+        self.assertEqual(result["deleted"], 1)
+        fake_client.vector_stores.files.delete.assert_called_once_with(vector_store_id="vs_1", file_id="file-1")
+        
+    def _stale_store_client(self):
+        """Return a fake client whose cached store vs_old is gone and was recreated as vs_new."""
+        not_found = vectorstore_utils.NotFoundError(
+            "gone",
+            response=httpx.Response(404, request=httpx.Request("GET", "https://api.openai.com/v1/x")),
+            body=None
+        )
+        
+        def raise_for_old_store(vector_store_id, **kwargs):
+            if vector_store_id == "vs_old":
+                raise not_found
+            return [mock.Mock(id="file-1", attributes={"assignedTo": "Asha"})]
+        
+        store = mock.Mock(id="vs_new")
+        store.name = "techcorp_leads"
+        fake_client = mock.Mock()
+        fake_client.vector_stores.list.return_value = [store]
+        fake_client.vector_stores.delete.side_effect = raise_for_old_store
+        fake_client.vector_stores.files.list.side_effect = raise_for_old_store
+        return fake_client
+    
+    def test_delete_resolves_recreated_store_after_not_found(self):
+        """Test that full and filtered deletes re-resolve a stale store ID instead of reporting success."""
+        for filters in ({}, {"assigned_to": "Asha"}):
+            fake_client = self._stale_store_client()
+            id_cache = vectorstore_utils._TTLCache(8, 300)
+            id_cache.set("techcorp_leads", "vs_old")
+            
+            with mock.patch.object(vectorstore_utils, "client", fake_client), \
+                 mock.patch.object(vectorstore_utils, "_vector_store_ids", id_cache):
+                result = vectorstore_utils.delete_vectors_by_filter("TechCorp", **filters)
+            
+            if filters:
+                self.assertEqual(result["deleted"], 1)
+                fake_client.vector_stores.files.delete.assert_called_once_with(vector_store_id="vs_new", file_id="file-1")
+            else:
+                self.assertEqual(result["deleted"], "all")
+                self.assertEqual([call.args[0] for call in fake_client.vector_stores.delete.call_args_list], ["vs_old", "vs_new"])
+        
+    def test_async_client_leaves_retries_to_the_backoff_policy(self):
+        """Test that the client used under retry_openai_errors does not retry on its own as well."""
+        with mock.patch.object(vectorstore_utils, "AsyncOpenAI") as async_openai:
+            vectorstore_utils._create_async_client()
+        self.assertEqual(async_openai.call_args.kwargs["max_retries"], 0)
+        
+    def test_retry_wait_honours_retry_after(self):
+        """Test that a 429's Retry-After overrides the exponential wait, capped at max_value."""
+        def rate_limit(headers):
+            return vectorstore_utils.RateLimitError("rate limited", response=mock.Mock(headers=headers), body=None)
+        
+        waits = vectorstore_utils._openai_retry_wait(factor=2, max_value=30)
+        next(waits)
+        self.assertEqual(waits.send(rate_limit({"retry-after": "7"})), 7)
+        self.assertEqual(waits.send(rate_limit({"retry-after-ms": "1500"})), 1.5)
+        self.assertEqual(waits.send(rate_limit({"retry-after": "600"})), 30)
+        connection_error = vectorstore_utils.APIConnectionError(
+            message="reset", request=httpx.Request("POST", "https://api.openai.com/v1/x")
+        )
+        self.assertLessEqual(waits.send(connection_error), 30)
+        
+    def test_vector_store_id_lookup_is_cached(self):
+        """Test that store IDs are listed once per name, read from disk once per process, and dropped on delete."""
+        store = mock.Mock(id="vs_1")
+        store.name = "techcorp_leads"  # Mock() reserves the name keyword
+        fake_client = mock.Mock()
+        fake_client.vector_stores.list.return_value = [store]
+        
+        with mock.patch.object(vectorstore_utils, "client", fake_client), \
+             mock.patch.object(vectorstore_utils, "_vector_store_ids", vectorstore_utils._TTLCache(8, 300)):
+            self.assertEqual(vectorstore_utils._get_vector_store_id("techcorp_leads"), "vs_1")
+            self.assertEqual(vectorstore_utils._get_vector_store_id("techcorp_leads"), "vs_1")
+            self.assertIsNone(vectorstore_utils._get_vector_store_id("kalco_leads"))
+            self.assertEqual(fake_client.vector_stores.list.call_count, 2)
+            
+            # A new process picks the ID up from disk without listing again
+            with mock.patch.object(vectorstore_utils, "_vector_store_ids", vectorstore_utils._TTLCache(8, 300)), \
+                 mock.patch.object(vectorstore_utils, "_persisted_id_names", set()):
+                self.assertEqual(vectorstore_utils._get_vector_store_id("techcorp_leads"), "vs_1")
+            self.assertEqual(fake_client.vector_stores.list.call_count, 2)
+            
+            # Once the memory entry expires, the same process lists again instead of reading disk
+            with mock.patch.object(vectorstore_utils, "_vector_store_ids", vectorstore_utils._TTLCache(8, 300)):
+                self.assertEqual(vectorstore_utils._get_vector_store_id("techcorp_leads"), "vs_1")
+            self.assertEqual(fake_client.vector_stores.list.call_count, 3)
+            
+            vectorstore_utils._delete_vector_store("techcorp_leads", "vs_1")
+            fake_client.vector_stores.delete.assert_called_once_with("vs_1")
+            self.assertIsNone(vectorstore_utils._vector_store_ids.get("techcorp_leads"))
+            self.assertIsNone(vectorstore_utils._load_persisted_vector_store_id("techcorp_leads"))
+
+    def _run_upsert(self, file_batch_create):
+        """
+        Upsert documents A (unchanged), B (changed) and D (new) over a store that
+        holds A, B and C, with file_batches.create mocked by file_batch_create.
+        
+        Returns:
+            tuple: (upsert result, fake sync client, fake async client, {doc ID: content hash})
+        """
+        def doc(doc_id, text):
+            return {"id": doc_id, "text": text, "metadata": {"assignedTo": "Asha"}}
+        
+        def content_hash(document):
+            content = vectorstore_utils._render_document_file("Company: TechCorp\n", document)
+            return hashlib.sha256(content).hexdigest()
+        
+        documents = [doc("A", "alpha"), doc("B", "beta v2"), doc("D", "delta")]
+        hashes = {document["id"]: content_hash(document) for document in documents}
+        save_file_cache("TechCorp", {
+            "A": (hashes["A"], "file-A"), "B": ("old-b", "file-B"), "C": ("old-c", "file-C")
+        })
+        
+        store = mock.Mock(id="vs_1")
+        store.name = "techcorp_leads"
+        fake_client = mock.Mock()
+        fake_client.vector_stores.list.return_value = [store]
+        fake_client.vector_stores.files.list.return_value = [
+            mock.Mock(id=file_id, status="completed", attributes=None) for file_id in ("file-A", "file-B", "file-C")
+        ]
+        fake_client.files.list.return_value = [
+            mock.Mock(id="file-A", filename=f"{hashes['A']}.txt"),
+            mock.Mock(id="file-B", filename="b.txt"),
+            mock.Mock(id="file-C", filename="c.txt"),
+        ]
+        
+        async_client = mock.Mock()
+        async_client.files.create = mock.AsyncMock(
+            side_effect=lambda file, purpose: mock.Mock(id=f"file-{file[0][:8]}")
+        )
+        async_client.vector_stores.file_batches.create = mock.AsyncMock(side_effect=file_batch_create)
+        async_client.vector_stores.files.update = mock.AsyncMock()
+        async_client_context = mock.MagicMock()
+        async_client_context.__aenter__.return_value = async_client
+        
+        with mock.patch.object(vectorstore_utils, "client", fake_client), \
+             mock.patch.object(vectorstore_utils, "_vector_store_ids", vectorstore_utils._TTLCache(8, 300)), \
+             mock.patch.object(vectorstore_utils, "_create_async_client", return_value=async_client_context):
+            result = vectorstore_utils.upsert_chunked_documents("TechCorp", documents)
+        return result, fake_client, async_client, hashes
+    
+    def test_upsert_reuses_unchanged_files_and_detaches_replaced_ones(self):
+        """Test that an upsert uploads only changed content and detaches superseded files."""
+        result, fake_client, async_client, hashes = self._run_upsert(
+            lambda **kwargs: mock.Mock(id="batch-1", status="completed")
+        )
+        new_b, new_d = f"file-{hashes['B'][:8]}", f"file-{hashes['D'][:8]}"
+        
+        self.assertEqual(result["upserted"], 3)
+        self.assertEqual(async_client.files.create.await_count, 2)
+        batch_kwargs = async_client.vector_stores.file_batches.create.await_args.kwargs
+        self.assertEqual(sorted(batch_kwargs["file_ids"]), sorted([new_b, new_d]))
+        self.assertEqual(batch_kwargs["attributes"], {"assignedTo": "Asha"})
+        # The unchanged file stays attached but gets the attributes it was attached without
+        async_client.vector_stores.files.update.assert_awaited_once_with(
+            file_id="file-A", vector_store_id="vs_1", attributes={"assignedTo": "Asha"}
+        )
+        
+        detached = {call.kwargs["file_id"] for call in fake_client.vector_stores.files.delete.call_args_list}
+        self.assertEqual(detached, {"file-B", "file-C"})
+        self.assertEqual({call.args[0] for call in fake_client.files.delete.call_args_list}, {"file-B", "file-C"})
+        self.assertEqual(load_file_cache("TechCorp"), {
+            "A": (hashes["A"], "file-A"), "B": (hashes["B"], new_b), "D": (hashes["D"], new_d)
+        })
+    
+    def test_upsert_keeps_previous_files_when_batch_fails(self):
+        """Test that a failed file batch leaves the previous version of its documents attached."""
+        def fail_batch(**kwargs):
+            raise RuntimeError("batch rejected")
+        
+        result, fake_client, _, hashes = self._run_upsert(fail_batch)
+        
+        self.assertEqual(result["upserted"], 1)
+        detached = {call.kwargs["file_id"] for call in fake_client.vector_stores.files.delete.call_args_list}
+        self.assertEqual(detached, {"file-C"})
+        self.assertEqual({call.args[0] for call in fake_client.files.delete.call_args_list}, {"file-C"})
+        self.assertEqual(load_file_cache("TechCorp"), {
+            "A": (hashes["A"], "file-A"), "B": ("old-b", "file-B")
+        })
+    
+    def test_upsert_relists_store_when_cached_id_is_gone(self):
+        """Test that a stale cached store ID leads to a lookup by name, not a duplicate store."""
+        store = mock.Mock(id="vs_new")
+        store.name = "techcorp_leads"
+        not_found = vectorstore_utils.NotFoundError(
+            "gone",
+            response=httpx.Response(404, request=httpx.Request("GET", "https://api.openai.com/v1/x")),
+            body=None
+        )
+        
+        def list_files(vector_store_id, limit):
+            if vector_store_id == "vs_old":
+                raise not_found
+            return []
+        
+        fake_client = mock.Mock()
+        fake_client.vector_stores.list.return_value = [store]
+        fake_client.vector_stores.files.list.side_effect = list_files
+        fake_client.files.list.return_value = []
+        async_client = mock.Mock()
+        async_client.files.create = mock.AsyncMock(return_value=mock.Mock(id="file-1"))
+        async_client.vector_stores.file_batches.create = mock.AsyncMock(
+            return_value=mock.Mock(id="batch-1", status="completed")
+        )
+        async_client_context = mock.MagicMock()
+        async_client_context.__aenter__.return_value = async_client
+        id_cache = vectorstore_utils._TTLCache(8, 300)
+        id_cache.set("techcorp_leads", "vs_old")
+        
+        with mock.patch.object(vectorstore_utils, "client", fake_client), \
+             mock.patch.object(vectorstore_utils, "_vector_store_ids", id_cache), \
+             mock.patch.object(vectorstore_utils, "_create_async_client", return_value=async_client_context):
+            result = vectorstore_utils.upsert_chunked_documents(
+                "TechCorp", [{"id": "A", "text": "alpha", "metadata": {}}]
+            )
+            self.assertEqual(id_cache.get("techcorp_leads"), "vs_new")
+        
+        self.assertEqual(result["vector_store_id"], "vs_new")
+        fake_client.vector_stores.create.assert_not_called()
+    
+    def test_search_results_are_cached_until_invalidated(self):
+        """Test that identical searches reuse results until the company's store changes."""
+        result = mock.Mock(file_id="file-1", filename="a.txt", score=0.9, attributes={"assignedTo": "Manager A"})
+        result.content = [mock.Mock(text="Lead from TechCorp")]
+        fake_client = mock.Mock()
+        fake_client.vector_stores.search.return_value.data = [result]
+        
+        store_ids = vectorstore_utils._TTLCache(8, 300)
+        store_ids.set("techcorp_leads", "vs_1")
+        
+        with mock.patch.object(vectorstore_utils, "client", fake_client), \
+             mock.patch.object(vectorstore_utils, "_vector_store_ids", store_ids), \
+             mock.patch.object(vectorstore_utils, "_search_cache", vectorstore_utils._TTLCache(8, 60)):
+            first = vectorstore_utils.search_vector_store("TechCorp", "Open leads?", top_k=5)
+            second = vectorstore_utils.search_vector_store("TechCorp", "  open leads? ", top_k=5)
+            self.assertEqual(first, second)
+            self.assertEqual(first[0]["metadata"]["assignedTo"], "Manager A")
+            self.assertEqual(fake_client.vector_stores.search.call_count, 1)
+            
+            vectorstore_utils._invalidate_search_cache("TechCorp")
+            vectorstore_utils.search_vector_store("TechCorp", "open leads?", top_k=5)
+            self.assertEqual(fake_client.vector_stores.search.call_count, 2)
+
+class TestModelCircuitBreaker(unittest.TestCase):
+    """Test cases for the primary model circuit breaker in main."""
+    
+    def setUp(self):
+        """Drive the breaker with a controllable monotonic clock."""
+        self.now = 1000.0
+        clock = mock.patch.object(main.time, "monotonic", side_effect=lambda: self.now)
+        clock.start()
+        self.addCleanup(clock.stop)
+        self.breaker = main.ModelCircuitBreaker("gpt-4o", fail_max=3, reset_timeout=30)
+    
+    def test_opens_after_fail_max_failures(self):
+        """Test that the circuit stays closed below fail_max and opens at it."""
+        for _ in range(2):
+            self.breaker.record_failure()
+            self.assertTrue(self.breaker.allow_request())
+        
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow_request())
+        self.now += 29
+        self.assertFalse(self.breaker.allow_request())
+    
+    def test_rate_limit_opens_immediately_for_retry_after(self):
+        """Test that a 429 opens the circuit at once, for Retry-After when it exceeds reset_timeout."""
+        self.breaker.record_failure(retry_after=60)
+        self.assertFalse(self.breaker.allow_request())
+        self.now += 45
+        self.assertFalse(self.breaker.allow_request())
+        self.now += 16
+        self.assertTrue(self.breaker.allow_request())
+    
+    def test_single_trial_call_after_cooldown(self):
+        """Test that only one trial call passes after open_until, and its outcome closes or reopens the circuit."""
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.now += 31
+        
+        self.assertTrue(self.breaker.allow_request())
+        self.assertFalse(self.breaker.allow_request())
+        self.breaker.record_failure()
+        self.assertFalse(self.breaker.allow_request())
+        
+        self.now += 31
+        self.assertTrue(self.breaker.allow_request())
+        self.breaker.record_success()
+        self.assertTrue(self.breaker.allow_request())
+        self.assertTrue(self.breaker.allow_request())
 
 class TestIntegration(unittest.TestCase):
     """Integration test stubs with mocked dependencies."""
     
-    def setUp(self):
-        """Set up test dependencies."""
-        self.sample_leads = [
-            {
-                "id": "LEAD001",
-                "projectName": "Office Complex",
-                "clientDetails": {"name": "Client A", "phoneNumber": "+91-1111111111"},
-                "assignedTo": "Manager A",
-                "assignedToId": "MGA001",
-                "updatedAt": "2024-01-15T10:00:00Z"
-            },
-            {
-                "id": "LEAD002", 
-                "projectName": "Residential Tower",
-                "clientDetails": {"name": "Client B", "phoneNumber": "+91-2222222222"},
-                "assignedTo": "Manager B",
-                "assignedToId": "MGB001",
-                "updatedAt": "2024-01-16T11:00:00Z"
-            }
-        ]
+    @classmethod
+    def setUpClass(cls):
+        """Set up test dependencies shared by every test in the class."""
+        cls.sample_leads = SAMPLE_LEADS
     
     def test_end_to_end_lead_processing_mock(self):
         """Test end-to-end lead processing with mocked vector store operations."""
         # This would be a full integration test with mocked OpenAI and Firebase calls
         
-        company_name = "TestCompany"
+        company_name = TEST_COMPANY_NAME
         
         # Step 1: Mock fetch leads (would come from Firebase)
         leads = self.sample_leads
@@ -4,42 +4,139 @@ Vector Store Utilities Module
 Functions for OpenAI Vector Store operations and embedding management.
 """
 
+import io
+import json
 import os
 import logging
 import time
-import tempfile
-from typing import List, Dict, Any, Optional
-from openai import OpenAI
-import asyncio
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from functools import lru_cache, partial
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Set, Tuple
+import httpx
+from openai import (
+    OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient,
+    APIConnectionError, InternalServerError, NotFoundError, OpenAIError, RateLimitError
+)
+import asyncio
 import backoff
 from dotenv import load_dotenv
 
+try:
+    import tiktoken
+except ImportError:  # Optional: only used to size batches for the deprecated embed_texts
+    tiktoken = None
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
-# Initialize OpenAI client with graceful handling for tests
-try:
+# Keep warm sockets to the OpenAI API so sporadic calls skip DNS and TLS setup;
+# sized so concurrent uploads never exhaust the pool
+OPENAI_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=50, max_connections=100, keepalive_expiry=60)
+# Fail fast on connect; the read budget leaves room for long chat completions
+OPENAI_HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+
+def build_openai_http_client() -> httpx.Client:
+    """Create a pooled HTTP/2 client for an OpenAI client to reuse across calls."""
+    return DefaultHttpxClient(http2=True, limits=OPENAI_HTTP_LIMITS, timeout=OPENAI_HTTP_TIMEOUT)
+
+def _get_api_key() -> str:
+    """Return OPENAI_API_KEY, raising before any HTTP client is built for a client that cannot work."""
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         logger.error("OPENAI_API_KEY environment variable is not set")
-        client = None
-    else:
-        # Initialize with basic parameters only
-        client = OpenAI(api_key=api_key)
-        logger.info("OpenAI client initialized successfully")
-except Exception as e:
-    logger.error(f"OpenAI client initialization failed: {e}")
-    # Try with minimal initialization
+        raise OpenAIError("The OPENAI_API_KEY environment variable must be set")
+    return api_key
+
+def _create_async_client() -> AsyncOpenAI:
+    """
+    Create an async OpenAI client; its connection pool is bound to the running event loop.
+    
+    SDK retries are disabled because every call made through this client is
+    wrapped in retry_openai_errors, which is the single retry policy for them.
+    """
+    return AsyncOpenAI(
+        api_key=_get_api_key(),
+        max_retries=0,
+        http_client=DefaultAsyncHttpxClient(http2=True, limits=OPENAI_HTTP_LIMITS, timeout=OPENAI_HTTP_TIMEOUT)
+    )
+
+# OpenAI client, created on first use so importing this module needs no network or API key
+client: Optional[OpenAI] = None
+# Guards client creation when the first calls arrive from several threads
+_client_lock = threading.Lock()
+
+def get_openai_client() -> OpenAI:
+    """Return the shared OpenAI client, creating it on first use."""
+    global client
+    if client is None:
+        with _client_lock:
+            if client is None:
+                client = OpenAI(api_key=_get_api_key(), http_client=build_openai_http_client())
+                logger.info("OpenAI client initialized successfully")
+    return client
+
+# Transient OpenAI errors worth retrying (APITimeoutError is an APIConnectionError);
+# every other failure, including other 4xx responses, surfaces immediately
+RETRYABLE_OPENAI_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+
+def get_retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    Return the wait a 429 response asks for, if any.
+    
+    Reads retry-after-ms first and falls back to retry-after (in seconds), the
+    same headers the OpenAI SDK honours for its own retries.
+    
+    Args:
+        error: The exception raised by an OpenAI call
+        
+    Returns:
+        Optional[float]: Seconds to wait, or None if the error is not a rate limit or sets no header
+    """
+    if not isinstance(error, RateLimitError):
+        return None
     try:
-        import openai
-        openai.api_key = os.getenv("OPENAI_API_KEY")
-        client = OpenAI()
-        logger.info("OpenAI client initialized with fallback method")
-    except Exception as e2:
-        logger.error(f"Fallback initialization also failed: {e2}")
-        client = None
+        headers = error.response.headers
+        if headers.get("retry-after-ms") is not None:
+            return float(headers["retry-after-ms"]) / 1000
+        return float(headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+def _openai_retry_wait(factor: float = 2, max_value: float = 30):
+    """
+    backoff wait generator: a 429's Retry-After if present, else full-jitter exponential delay.
+    
+    backoff sends each caught exception into the generator before taking the
+    next wait, which is what lets a rate limit override the exponential schedule.
+    """
+    delays = backoff.expo(factor=factor, max_value=max_value)
+    next(delays)  # Skip expo's priming yield
+    error = yield
+    while True:
+        delay = backoff.full_jitter(next(delays))
+        retry_after = get_retry_after_seconds(error)
+        if retry_after is not None:
+            delay = min(retry_after, max_value)
+        error = yield delay
+
+# Retry policy for calls made through _create_async_client (whose SDK retries are off): waits
+# capped at 30s, jitter applied by _openai_retry_wait. Calls on the shared sync client rely on
+# the SDK's own retries instead, so the two policies never stack
+retry_openai_errors = backoff.on_exception(
+    _openai_retry_wait,
+    RETRYABLE_OPENAI_ERRORS,
+    max_tries=5,
+    max_time=120,
+    jitter=None
+)
 
+@lru_cache(maxsize=256)
 def getVectorStoreName(company_name: str) -> str:
     """
     Generate a standardized vector store name for a company.
@@ -52,18 +149,252 @@ def getVectorStoreName(company_name: str) -> str:
     """
     return f"{company_name.lower()}_leads"
 
-@backoff.on_exception(backoff.expo, Exception, max_tries=3, max_time=30)
-def embed_texts(texts: List[str], batch_size: int = 64) -> List[List[float]]:
+# Seconds a search result stays reusable for an identical (company, query, top_k)
+SEARCH_CACHE_TTL = 60
+# Maximum number of distinct searches kept in the result cache
+SEARCH_CACHE_MAXSIZE = 256
+
+class _TTLCache:
+    """Small thread-safe LRU cache whose entries also expire after a fixed TTL."""
+    
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: Any) -> Optional[Any]:
+        """Return the cached value, or None if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+    
+    def set(self, key: Any, value: Any) -> None:
+        """Store a value, evicting the least recently used entry when full."""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def pop(self, key: Any) -> None:
+        """Drop a single entry if present."""
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def invalidate(self, predicate) -> None:
+        """Drop every entry whose key matches the predicate."""
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+# Recent search results keyed by (company, normalized query, top_k)
+_search_cache = _TTLCache(SEARCH_CACHE_MAXSIZE, SEARCH_CACHE_TTL)
+
+def _invalidate_search_cache(company_name: str) -> None:
+    """Forget cached search results for a company after its vector store changes."""
+    _search_cache.invalidate(lambda key: key[0] == company_name)
+
+# Seconds a vector store ID stays cached before the store is looked up again, so
+# stores recreated by another process are picked up
+VECTOR_STORE_ID_TTL = 300
+# Maximum number of vector store names kept in the ID cache
+VECTOR_STORE_ID_CACHE_MAXSIZE = 256
+
+# Vector store IDs by store name, filled lazily so lookups skip the list() round-trip
+_vector_store_ids = _TTLCache(VECTOR_STORE_ID_CACHE_MAXSIZE, VECTOR_STORE_ID_TTL)
+# Store names whose persisted ID this process has already read; after that, a memory
+# miss (including an expired entry) lists stores instead of trusting the disk copy
+_persisted_id_names: Set[str] = set()
+
+def find_vector_store(vector_store_name: str):
+    """
+    Look up a vector store by name with a single scan of the store listing.
+    
+    Args:
+        vector_store_name: Name of the vector store
+        
+    Returns:
+        The matching vector store, or None if no store has that name
+    """
+    # Iterating the page (not .data) follows the cursor, so stores past the first page are found
+    vector_stores = get_openai_client().vector_stores.list(limit=100)
+    return next((store for store in vector_stores if store.name == vector_store_name), None)
+
+def _get_vector_store_id(vector_store_name: str) -> Optional[str]:
+    """
+    Find a vector store's ID by name, listing stores only on a cache miss or
+    once the cached ID is older than VECTOR_STORE_ID_TTL.
+    
+    The ID persisted by earlier runs is only consulted on a process's first
+    lookup of a name, so restarts skip the listing while expired memory
+    entries still trigger one.
+    
+    Args:
+        vector_store_name: Name of the vector store
+        
+    Returns:
+        Optional[str]: The vector store ID, or None if no store has that name
+    """
+    vector_store_id = _vector_store_ids.get(vector_store_name)
+    if vector_store_id:
+        return vector_store_id
+    
+    # A fresh process starts from the IDs recorded by earlier runs
+    if vector_store_name not in _persisted_id_names:
+        _persisted_id_names.add(vector_store_name)
+        vector_store_id = _load_persisted_vector_store_id(vector_store_name)
+        if vector_store_id:
+            _vector_store_ids.set(vector_store_name, vector_store_id)
+            return vector_store_id
+    
+    store = find_vector_store(vector_store_name)
+    if store is None:
+        # Misses are not cached so a store created elsewhere is picked up next time
+        return None
+    
+    _cache_vector_store_id(vector_store_name, store.id)
+    return store.id
+
+def _cache_vector_store_id(vector_store_name: str, vector_store_id: Optional[str]) -> None:
+    """Record a vector store's ID in memory and on disk, or drop both entries when the ID is None."""
+    if vector_store_id:
+        _vector_store_ids.set(vector_store_name, vector_store_id)
+    else:
+        _vector_store_ids.pop(vector_store_name)
+    _persist_vector_store_id(vector_store_name, vector_store_id)
+
+def _delete_vector_store(vector_store_name: str, vector_store_id: str) -> None:
+    """
+    Delete a vector store and drop its cached ID.
+    
+    If the ID turns out to be stale, the name is looked up once more so a store
+    recreated elsewhere under the same name is still deleted; a store that is
+    simply gone is ignored.
+    
+    Args:
+        vector_store_name: Name of the vector store
+        vector_store_id: The (possibly cached) ID of the vector store
+    """
+    try:
+        get_openai_client().vector_stores.delete(vector_store_id)
+    except NotFoundError:
+        _cache_vector_store_id(vector_store_name, None)
+        current_id = _get_vector_store_id(vector_store_name)
+        if current_id and current_id != vector_store_id:
+            logger.info(f"Vector store {vector_store_name} was recreated as {current_id}, deleting it")
+            try:
+                get_openai_client().vector_stores.delete(current_id)
+            except NotFoundError:
+                pass
+        else:
+            logger.info(f"Vector store {vector_store_name} was already deleted")
+    finally:
+        _cache_vector_store_id(vector_store_name, None)
+
+# Embedding requests kept in flight at once by embed_texts_async
+EMBEDDING_CONCURRENCY = 10
+
+# Model used by embed_texts
+EMBEDDING_MODEL = "text-embedding-3-small"
+# Token budget per embeddings request, kept under the API's 300k-token per-request cap
+EMBEDDING_MAX_TOKENS_PER_REQUEST = 250_000
+# ASCII characters per token assumed when estimating token counts without tiktoken; other
+# characters are counted as one token per UTF-8 byte, since no token is shorter than a byte
+APPROX_CHARS_PER_TOKEN = 4
+# Threads tiktoken uses to tokenize a batch of texts
+TOKENIZER_THREADS = os.cpu_count() or 1
+
+@lru_cache(maxsize=1)
+def _get_embedding_encoding():
+    """Return the tokenizer for EMBEDDING_MODEL, or None when tiktoken is not installed or cannot load it."""
+    if tiktoken is None:
+        return None
+    try:
+        # The BPE file is downloaded on first use, which fails without network egress
+        return tiktoken.encoding_for_model(EMBEDDING_MODEL)
+    except Exception as e:
+        logger.warning(f"Could not load the tiktoken encoding, estimating token counts instead: {e}")
+        return None
+
+def _estimate_tokens(text: str) -> int:
+    """Estimate a text's token count without tiktoken, erring high for non-Latin scripts."""
+    ascii_chars = sum(1 for char in text if char.isascii())
+    non_ascii_bytes = len(text.encode('utf-8')) - ascii_chars
+    return ascii_chars // APPROX_CHARS_PER_TOKEN + non_ascii_bytes + 1
+
+def _count_tokens(texts: List[str]) -> List[int]:
+    """
+    Count tokens per text with tiktoken, or estimate them from length without it.
+    
+    encode_ordinary_batch tokenizes on tiktoken's own thread pool, outside the GIL,
+    so large ingests use every core without forking workers.
+    """
+    encoding = _get_embedding_encoding()
+    if encoding is None:
+        return [_estimate_tokens(text) for text in texts]
+    return [len(tokens) for tokens in encoding.encode_ordinary_batch(texts, num_threads=TOKENIZER_THREADS)]
+
+def _pack_embedding_batches(
+    token_counts: List[int],
+    max_items: int,
+    max_tokens: int = EMBEDDING_MAX_TOKENS_PER_REQUEST
+) -> List[Tuple[int, int]]:
+    """
+    Greedily pack consecutive texts into request-sized batches.
+    
+    A batch closes when adding the next text would exceed max_items texts or
+    max_tokens tokens; a single text over the token budget gets its own batch.
+    
+    Args:
+        token_counts: Token count of each text, in the order they are batched
+        max_items: Maximum number of texts per batch
+        max_tokens: Maximum total tokens per batch
+        
+    Returns:
+        List[Tuple[int, int]]: (start, end) slice bounds of each batch
+    """
+    batches = []
+    start = 0
+    batch_tokens = 0
+    for i, tokens in enumerate(token_counts):
+        if i > start and (i - start >= max_items or batch_tokens + tokens > max_tokens):
+            batches.append((start, i))
+            start = i
+            batch_tokens = 0
+        batch_tokens += tokens
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+    return batches
+
+async def embed_texts_async(
+    texts: List[str],
+    batch_size: int = 64,
+    concurrency: int = EMBEDDING_CONCURRENCY
+) -> List[List[float]]:
     """
     Embed a list of texts using OpenAI's text-embedding-3-small model.
     
+    Duplicate texts are embedded once, and texts are batched in token-count
+    order so each request carries similarly sized inputs. Batches hold at most
+    batch_size texts and EMBEDDING_MAX_TOKENS_PER_REQUEST tokens. They are
+    requested concurrently (at most `concurrency` at a time); the embeddings
+    are returned in input order.
+    
     NOTE: This function is deprecated in favor of the chunked document approach
     where OpenAI handles embeddings automatically through the vector store API.
     Kept for backward compatibility.
     
     Args:
         texts: List of text strings to embed
-        batch_size: Number of texts to process in each batch
+        batch_size: Maximum number of texts in each batch
+        concurrency: Maximum number of embedding requests in flight
         
     Returns:
         List[List[float]]: List of embedding vectors
@@ -72,42 +403,559 @@ def embed_texts(texts: List[str], batch_size: int = 64) -> List[List[float]]:
     if not texts:
         return []
     
-    all_embeddings = []
+    # Embed each distinct text once, smallest first, and map back to the caller's order at the end
+    distinct_texts = list(dict.fromkeys(texts))
+    # Tokenizing (and the first load of the encoding) is CPU/disk work, so keep it off the event loop
+    token_counts = await asyncio.to_thread(_count_tokens, distinct_texts)
+    tokens_by_text = dict(zip(distinct_texts, token_counts))
+    unique_texts = sorted(distinct_texts, key=tokens_by_text.__getitem__)
+    batch_bounds = _pack_embedding_batches([tokens_by_text[text] for text in unique_texts], batch_size)
+    request_slots = asyncio.Semaphore(concurrency)
     
-    # Process in batches to avoid API limits
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i + batch_size]
-        
+    @retry_openai_errors
+    async def embed_batch(async_client: AsyncOpenAI, batch_num: int, start: int, end: int) -> List[List[float]]:
+        """Embed unique_texts[start:end], retrying this batch on its own."""
+        batch = unique_texts[start:end]
         try:
-            logger.info(f"Embedding batch {i//batch_size + 1} ({len(batch)} texts)")
-            
-            response = client.embeddings.create(
-                model="text-embedding-3-small",
-                input=batch
-            )
-            
-            batch_embeddings = [embedding.embedding for embedding in response.data]
-            all_embeddings.extend(batch_embeddings)
-            
-            # Small delay between batches to be respectful to the API
-            if i + batch_size < len(texts):
-                time.sleep(0.1)
-                
+            async with request_slots:
+                logger.info(f"Embedding batch {batch_num} ({len(batch)} texts)")
+                response = await async_client.embeddings.create(
+                    model=EMBEDDING_MODEL,
+                    input=batch
+                )
+            return [embedding.embedding for embedding in response.data]
         except Exception as e:
-            logger.error(f"Error embedding batch starting at index {i}: {e}")
+            logger.error(f"Error embedding batch starting at index {start}: {e}")
             raise
     
+    # Process in batches to avoid API limits
+    async with _create_async_client() as async_client:
+        batch_embeddings = await asyncio.gather(*(
+            embed_batch(async_client, batch_num, start, end)
+            for batch_num, (start, end) in enumerate(batch_bounds, 1)
+        ))
+    
+    embeddings_by_text = dict(zip(unique_texts, (embedding for batch in batch_embeddings for embedding in batch)))
+    all_embeddings = [embeddings_by_text[text] for text in texts]
     logger.info(f"Successfully embedded {len(all_embeddings)} texts")
     return all_embeddings
 
-@backoff.on_exception(backoff.expo, Exception, max_tries=3, max_time=60)
-def upsert_chunked_documents(company_name: str, documents: List[Dict[str, Any]]) -> dict:
+def embed_texts(texts: List[str], batch_size: int = 64) -> List[List[float]]:
+    """
+    Synchronous wrapper around embed_texts_async for non-async callers.
+    
+    Args:
+        texts: List of text strings to embed
+        batch_size: Number of texts to process in each batch
+        
+    Returns:
+        List[List[float]]: List of embedding vectors
+    """
+    return asyncio.run(embed_texts_async(texts, batch_size))
+
+# Number of chunk documents attached to the vector store per file batch
+FILE_BATCH_SIZE = 50
+
+# Chunk metadata copied onto each vector store file as attributes, for filtering and search results
+FILE_ATTRIBUTE_KEYS = ("assignedTo", "assignedToId", "updatedAt")
+
+# File uploads kept in flight at once; uploads are bound by API latency, not CPU
+UPLOAD_CONCURRENCY = 10
+
+# File batches uploaded and indexed at the same time during an upsert
+UPSERT_BATCH_WORKERS = 4
+
+# Files detached from a vector store at once when removing stale or filtered files
+DETACH_CONCURRENCY = 10
+
+# First and maximum delay in seconds between file batch status polls
+FILE_BATCH_POLL_INITIAL_DELAY = 0.5
+FILE_BATCH_POLL_MAX_DELAY = 10
+
+# Upper bound the vector store search endpoint accepts for max_num_results
+MAX_SEARCH_RESULTS = 50
+
+# SQLite cache mapping each chunk document to the uploaded OpenAI file holding its content,
+# plus the vector store ID behind each store name; set FILE_CACHE_PATH to keep it outside
+# the source tree (e.g. on read-only deploys)
+FILE_CACHE_PATH = Path(os.getenv("FILE_CACHE_PATH") or Path(__file__).parent / "file_cache.sqlite")
+
+# Seconds a persisted vector store ID is trusted when a new process first looks the
+# store up; stale IDs are also dropped as soon as an API call reports the store missing
+PERSISTED_VECTOR_STORE_ID_TTL = 24 * 60 * 60
+
+def _open_file_cache() -> sqlite3.Connection:
+    """Open the file cache database, creating the tables on first use."""
+    conn = sqlite3.connect(FILE_CACHE_PATH)
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS file_cache (
+            company TEXT NOT NULL,
+            doc_id TEXT NOT NULL,
+            content_hash TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            PRIMARY KEY (company, doc_id)
+        )"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS vector_store_ids (
+            name TEXT PRIMARY KEY,
+            vector_store_id TEXT NOT NULL,
+            cached_at REAL NOT NULL
+        )"""
+    )
+    return conn
+
+def _load_persisted_vector_store_id(vector_store_name: str) -> Optional[str]:
+    """Return the vector store ID recorded on disk, unless it is missing or too old."""
+    try:
+        with closing(_open_file_cache()) as conn:
+            row = conn.execute(
+                "SELECT vector_store_id, cached_at FROM vector_store_ids WHERE name = ?",
+                (vector_store_name,)
+            ).fetchone()
+    except sqlite3.Error as e:
+        logger.warning(f"Error reading cached vector store ID for {vector_store_name}: {e}")
+        return None
+    
+    if row is None or time.time() - row[1] > PERSISTED_VECTOR_STORE_ID_TTL:
+        return None
+    return row[0]
+
+def _persist_vector_store_id(vector_store_name: str, vector_store_id: Optional[str]) -> None:
+    """Record a vector store ID on disk, or remove the record when the ID is None."""
+    try:
+        with closing(_open_file_cache()) as conn, conn:
+            if vector_store_id:
+                conn.execute(
+                    "INSERT OR REPLACE INTO vector_store_ids (name, vector_store_id, cached_at) VALUES (?, ?, ?)",
+                    (vector_store_name, vector_store_id, time.time())
+                )
+            else:
+                conn.execute("DELETE FROM vector_store_ids WHERE name = ?", (vector_store_name,))
+    except sqlite3.Error as e:
+        logger.warning(f"Error caching vector store ID for {vector_store_name}: {e}")
+
+def load_file_cache(company_name: str) -> Dict[str, Tuple[str, str]]:
+    """
+    Load the cached uploads for a company.
+    
+    An unreadable cache (read-only or locked database) is treated as empty:
+    uploads are then matched by their content-hash filenames alone.
+    
+    Args:
+        company_name: The name of the company
+        
+    Returns:
+        Dict[str, Tuple[str, str]]: Document ID -> (content hash, OpenAI file ID)
+    """
+    try:
+        with closing(_open_file_cache()) as conn:
+            rows = conn.execute(
+                "SELECT doc_id, content_hash, file_id FROM file_cache WHERE company = ?",
+                (company_name,)
+            ).fetchall()
+    except sqlite3.Error as e:
+        logger.warning(f"Error reading file cache for {company_name}: {e}")
+        return {}
+    return {doc_id: (content_hash, file_id) for doc_id, content_hash, file_id in rows}
+
+def save_file_cache(company_name: str, entries: Dict[str, Tuple[str, str]]) -> None:
+    """
+    Replace the cached uploads for a company in a single transaction.
+    
+    A failed write is logged rather than raised, since the uploads it
+    records have already succeeded.
+    
+    Args:
+        company_name: The name of the company
+        entries: Document ID -> (content hash, OpenAI file ID)
+    """
+    try:
+        with closing(_open_file_cache()) as conn, conn:
+            conn.execute("DELETE FROM file_cache WHERE company = ?", (company_name,))
+            conn.executemany(
+                "INSERT INTO file_cache (company, doc_id, content_hash, file_id) VALUES (?, ?, ?, ?)",
+                [(company_name, doc_id, content_hash, file_id)
+                 for doc_id, (content_hash, file_id) in entries.items()]
+            )
+    except sqlite3.Error as e:
+        logger.warning(f"Error writing file cache for {company_name}: {e}")
+
+def _is_content_hash(value: str) -> bool:
+    """Check whether a string looks like a hex SHA-256 digest."""
+    return len(value) == 64 and all(c in "0123456789abcdef" for c in value)
+
+def _load_reusable_files(company_name: str) -> Dict[str, str]:
+    """
+    Find uploads that can be reattached instead of uploading the same content again.
+    
+    Uploads are named "<sha256 of content>.txt", so live files are matched by
+    content hash even when the local cache is missing or was built for other
+    document IDs. Cached entries cover uploads made before files were named by hash.
+    
+    Args:
+        company_name: The name of the company
+        
+    Returns:
+        Dict[str, str]: Content hash -> OpenAI file ID for files that still exist
+    """
+    live_files = {f.id: f.filename for f in get_openai_client().files.list(purpose="assistants")}
+    
+    reusable_files = {}
+    for file_id, filename in live_files.items():
+        content_hash, _, extension = (filename or "").partition(".")
+        if extension == "txt" and _is_content_hash(content_hash):
+            reusable_files[content_hash] = file_id
+    
+    for content_hash, file_id in load_file_cache(company_name).values():
+        if file_id in live_files:
+            reusable_files.setdefault(content_hash, file_id)
+    
+    return reusable_files
+
+def _update_file_cache(
+    company_name: str,
+    previous_files: Dict[str, Tuple[str, str]],
+    current_files: Dict[str, Tuple[str, str]]
+) -> None:
+    """Delete uploads superseded by this run and persist the new document -> file mapping."""
+    current_file_ids = {file_id for _, file_id in current_files.values()}
+    
+    for _, file_id in previous_files.values():
+        if file_id not in current_file_ids:
+            try:
+                get_openai_client().files.delete(file_id)
+            except Exception as e:
+                logger.warning(f"Error deleting stale file {file_id}: {e}")
+    
+    save_file_cache(company_name, current_files)
+
+def _list_vector_store_files(vector_store_id: str) -> Dict[str, Any]:
+    """Return every file attached to a vector store (with its status and attributes), keyed by file ID."""
+    # Iterating the page (not .data) follows the cursor, fetching 100 files per request
+    return {
+        store_file.id: store_file
+        for store_file in get_openai_client().vector_stores.files.list(vector_store_id=vector_store_id, limit=100)
+    }
+
+def _detach_file(vector_store_id: str, file_id: str) -> bool:
+    """Remove one file from a vector store; return whether it was attached."""
+    try:
+        get_openai_client().vector_stores.files.delete(vector_store_id=vector_store_id, file_id=file_id)
+        return True
+    except NotFoundError:
+        return False
+    except Exception as e:
+        logger.warning(f"Error detaching file {file_id}: {e}")
+        return False
+
+def _detach_files(vector_store_id: str, file_ids: List[str]) -> int:
+    """Remove files from a vector store concurrently; return how many were detached."""
+    if not file_ids:
+        return 0
+    with ThreadPoolExecutor(max_workers=min(DETACH_CONCURRENCY, len(file_ids))) as executor:
+        return sum(executor.map(partial(_detach_file, vector_store_id), file_ids))
+
+def _find_files_by_attributes(vector_store_id: str, filters: Dict[str, str]) -> List[str]:
+    """Return the IDs of vector store files whose attributes match every filter."""
+    return [
+        store_file.id
+        for store_file in get_openai_client().vector_stores.files.list(vector_store_id=vector_store_id, limit=100)
+        if all((store_file.attributes or {}).get(key) == value for key, value in filters.items())
+    ]
+
+@retry_openai_errors
+async def _create_file(
+    async_client: AsyncOpenAI,
+    filename: str,
+    content: bytes,
+    upload_slots: asyncio.Semaphore
+):
+    """Upload file content straight from memory, retrying this file alone on transient errors."""
+    async with upload_slots:
+        return await async_client.files.create(
+            file=(filename, io.BytesIO(content)),
+            purpose="assistants"
+        )
+
+def _render_document_file(content_prefix: str, doc: Dict[str, Any]) -> bytes:
+    """Render a chunked document as the structured text file uploaded for it."""
+    metadata = doc['metadata']
+    file_content = (
+        f"{content_prefix}"
+        f"Assignee: {metadata.get('assignedTo', 'Unknown')}\n"
+        f"Chunk: {metadata.get('chunk_index', 0) + 1} of {metadata.get('total_chunks', 1)}\n"
+        f"Total Leads: {metadata.get('total_leads', 0)}\n\n"
+        f"{doc['text']}\n\n"
+        f"---\n"
+        f"Metadata: {json.dumps(metadata, separators=(',', ':'), ensure_ascii=False, default=str)}"
+    )
+    return file_content.encode('utf-8')
+
+def _document_attributes(doc: Dict[str, Any]) -> Dict[str, str]:
+    """Return the vector store file attributes for a chunked document."""
+    metadata = doc['metadata']
+    return {key: str(metadata[key]) for key in FILE_ATTRIBUTE_KEYS if metadata.get(key)}
+
+def _split_document_batches(documents: List[Dict[str, Any]], batch_size: int) -> List[List[Dict[str, Any]]]:
+    """
+    Split documents into file batches of at most batch_size that share the same attributes.
+    
+    File batch attributes apply to every file in the batch, so a batch closes
+    whenever the next document belongs to another assignee (or was updated at a
+    different time). Documents of one assignee are contiguous, so this only
+    adds a batch per assignee boundary.
+    
+    Args:
+        documents: Chunked documents, grouped by assignee
+        batch_size: Maximum number of documents per batch
+        
+    Returns:
+        List[List[Dict[str, Any]]]: The document batches, in order
+    """
+    batches = []
+    batch_attributes = None
+    for doc in documents:
+        attributes = _document_attributes(doc)
+        if not batches or len(batches[-1]) >= batch_size or attributes != batch_attributes:
+            batches.append([])
+            batch_attributes = attributes
+        batches[-1].append(doc)
+    return batches
+
+async def _upload_document(
+    async_client: AsyncOpenAI,
+    doc_id: str,
+    content_hash: str,
+    content_bytes: bytes,
+    reusable_files: Dict[str, str],
+    upload_slots: asyncio.Semaphore
+) -> Optional[Tuple[str, str]]:
+    """
+    Upload one rendered document as a file, reusing an existing upload of the same content.
+    
+    Args:
+        async_client: Async OpenAI client for this upsert run
+        doc_id: ID of the chunked document, for logging
+        content_hash: SHA-256 hex digest of content_bytes
+        content_bytes: File content from _render_document_file
+        reusable_files: Existing uploads (content hash -> file ID)
+        upload_slots: Semaphore bounding the number of uploads in flight
+        
+    Returns:
+        Optional[Tuple[str, str]]: (content hash, file ID), or None if the upload failed
+    """
+    # Reuse an earlier upload if the content is unchanged
+    reusable_file_id = reusable_files.get(content_hash)
+    if reusable_file_id:
+        return content_hash, reusable_file_id
+    
+    try:
+        # Named by content hash so later runs can find it; the .txt extension tells file_search how to parse it
+        file_obj = await _create_file(async_client, f"{content_hash}.txt", content_bytes, upload_slots)
+        return content_hash, file_obj.id
+        
+    except Exception as e:
+        logger.warning(f"Error creating file for document {doc_id}: {e}")
+        return None
+
+@retry_openai_errors
+async def _create_file_batch(
+    async_client: AsyncOpenAI,
+    vector_store_id: str,
+    file_ids: List[str],
+    attributes: Dict[str, str]
+):
+    """Attach uploaded files to a vector store as one file batch, retrying transient errors."""
+    return await async_client.vector_stores.file_batches.create(
+        vector_store_id=vector_store_id,
+        file_ids=file_ids,
+        attributes=attributes
+    )
+
+@retry_openai_errors
+async def _retrieve_file_batch(async_client: AsyncOpenAI, vector_store_id: str, batch_id: str):
+    """Fetch the current state of a file batch, retrying transient errors."""
+    return await async_client.vector_stores.file_batches.retrieve(
+        vector_store_id=vector_store_id,
+        batch_id=batch_id
+    )
+
+@retry_openai_errors
+async def _update_file_attributes(
+    async_client: AsyncOpenAI,
+    vector_store_id: str,
+    file_id: str,
+    attributes: Dict[str, str],
+    upload_slots: asyncio.Semaphore
+):
+    """Replace the attributes of a file already attached to a vector store, retrying transient errors."""
+    async with upload_slots:
+        return await async_client.vector_stores.files.update(
+            file_id=file_id,
+            vector_store_id=vector_store_id,
+            attributes=attributes
+        )
+
+async def _refresh_file_attributes(
+    async_client: AsyncOpenAI,
+    vector_store_id: str,
+    batch_documents: List[Dict[str, Any]],
+    attached_files: Dict[str, Tuple[str, str]],
+    store_files: Dict[str, Any],
+    upload_slots: asyncio.Semaphore
+) -> None:
+    """
+    Bring the attributes of files that stay attached in line with their documents.
+    
+    Unchanged files are never resubmitted in a file batch, so without this they
+    would keep whatever attributes they were attached with, or none at all for
+    files attached before attributes were set.
+    
+    Args:
+        async_client: Async OpenAI client for this upsert run
+        vector_store_id: ID of the target vector store
+        batch_documents: Chunked documents in this batch
+        attached_files: (hash, file ID) of the batch's documents whose file is already attached
+        store_files: Files attached to the vector store, keyed by file ID
+        upload_slots: Semaphore bounding the number of requests in flight
+    """
+    updates = []
+    for doc in batch_documents:
+        if doc['id'] not in attached_files:
+            continue
+        file_id = attached_files[doc['id']][1]
+        attributes = _document_attributes(doc)
+        if (store_files[file_id].attributes or {}) != attributes:
+            updates.append((file_id, attributes))
+    
+    results = await asyncio.gather(*(
+        _update_file_attributes(async_client, vector_store_id, file_id, attributes, upload_slots)
+        for file_id, attributes in updates
+    ), return_exceptions=True)
+    for (file_id, _), result in zip(updates, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Error updating attributes of file {file_id}: {result}")
+
+async def _upload_document_batch(
+    async_client: AsyncOpenAI,
+    company_name: str,
+    vector_store_id: str,
+    batch_documents: List[Dict[str, Any]],
+    reusable_files: Dict[str, str],
+    current_files: Dict[str, Tuple[str, str]],
+    attached_file_ids: Set[str],
+    upload_slots: asyncio.Semaphore
+):
+    """
+    Upload one batch of chunked documents as files and attach them to the vector store.
+    
+    Files are uploaded concurrently. Documents whose content hash matches an
+    existing upload reuse that file instead of being uploaded again,
+    and files already attached to the vector store are not submitted again.
+    Attached files carry the batch's attributes (see _split_document_batches).
+    
+    Args:
+        async_client: Async OpenAI client for this upsert run
+        company_name: The name of the company
+        vector_store_id: ID of the target vector store
+        batch_documents: Chunked documents in this batch
+        reusable_files: Existing uploads (content hash -> file ID)
+        current_files: Filled with the (hash, file ID) used for each document
+        attached_file_ids: Files already attached to (and indexed in) the vector store
+        upload_slots: Semaphore bounding the number of uploads in flight
+        
+    Returns:
+        The created file batch, or None if nothing needed to be submitted
+    """
+    # Collect file IDs for this batch
+    file_ids = []
+    content_prefix = f"Company: {company_name}\n"
+    
+    # Render and hash every file up front so the uploads below are pure I/O
+    payloads = []
+    for doc in batch_documents:
+        try:
+            content_bytes = _render_document_file(content_prefix, doc)
+        except Exception as e:
+            logger.warning(f"Error creating file for document {doc['id']}: {e}")
+            continue
+        payloads.append((doc, hashlib.sha256(content_bytes).hexdigest(), content_bytes))
+    
+    uploads = await asyncio.gather(*(
+        _upload_document(async_client, doc['id'], content_hash, content_bytes, reusable_files, upload_slots)
+        for doc, content_hash, content_bytes in payloads
+    ))
+    for (doc, _, _), upload in zip(payloads, uploads):
+        if upload is None:
+            continue
+        current_files[doc['id']] = upload
+        if upload[1] not in attached_file_ids:
+            file_ids.append(upload[1])
+    
+    if not file_ids:
+        return None
+    
+    # Add files to vector store in a batch
+    try:
+        return await _create_file_batch(
+            async_client, vector_store_id, file_ids, _document_attributes(batch_documents[0])
+        )
+    except Exception as e:
+        logger.warning(f"Error processing file batch: {e}")
+        return None
+
+async def _wait_for_file_batch(async_client: AsyncOpenAI, vector_store_id: str, file_batch, max_wait: int = 180):
+    """
+    Poll a file batch until it leaves the queued/in-progress states or max_wait elapses.
+    
+    The poll interval doubles from FILE_BATCH_POLL_INITIAL_DELAY up to
+    FILE_BATCH_POLL_MAX_DELAY, so small batches are picked up quickly and
+    large ones are not retrieved needlessly often.
+    
+    Args:
+        async_client: Async OpenAI client for this upsert run
+        vector_store_id: ID of the vector store the batch belongs to
+        file_batch: The file batch returned by file_batches.create
+        max_wait: Maximum number of seconds to wait
+        
+    Returns:
+        The last retrieved file batch
+    """
+    deadline = time.monotonic() + max_wait
+    delay = FILE_BATCH_POLL_INITIAL_DELAY
+    
+    while file_batch.status in ["in_progress", "queued"] and time.monotonic() < deadline:
+        await asyncio.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+        delay = min(delay * 2, FILE_BATCH_POLL_MAX_DELAY)
+        file_batch = await _retrieve_file_batch(async_client, vector_store_id, file_batch.id)
+        logger.info(f"Batch status: {file_batch.status}")
+    
+    return file_batch
+
+async def upsert_chunked_documents_async(
+    company_name: str, 
+    documents: List[Dict[str, Any]],
+    batch_size: int = FILE_BATCH_SIZE
+) -> dict:
     """
     Upsert chunked documents into OpenAI Vector Store.
     
+    The company's existing vector store is updated in place: files whose
+    content is unchanged stay attached, new or changed documents are uploaded
+    and attached, and files no longer backing any document are detached.
+    A document's previous file is only detached once its replacement is in a
+    completed file batch, so a failed batch leaves the old version searchable.
+    
+    UPSERT_BATCH_WORKERS workers pull batches from a queue and each upload,
+    submit and await indexing of their batch, so later batches upload while
+    earlier ones are indexed. The workers share one AsyncOpenAI client and at
+    most UPLOAD_CONCURRENCY file uploads are in flight across all of them.
+    
     Args:
         company_name: The name of the company
         documents: List of chunked documents with keys: "id", "text", "metadata"
+        batch_size: Number of documents attached to the vector store per file batch
         
     Returns:
         dict: Summary of the upsert operation
@@ -118,119 +966,146 @@ def upsert_chunked_documents(company_name: str, documents: List[Dict[str, Any]])
     try:
         vector_store_name = getVectorStoreName(company_name)
         
-        # Delete existing vector store to ensure clean state
-        vector_stores = client.beta.vector_stores.list()
-        for store in vector_stores.data:
-            if store.name == vector_store_name:
-                logger.info(f"Deleting existing vector store: {vector_store_name}")
-                client.beta.vector_stores.delete(store.id)
-                break
-        
-        # Create new vector store
-        logger.info(f"Creating new vector store: {vector_store_name}")
-        target_store = client.beta.vector_stores.create(
-            name=vector_store_name,
-            metadata={"company": company_name, "document_type": "chunked_leads"}
-        )
+        # Reuse the existing vector store and diff against the files it already holds
+        vector_store_id = await asyncio.to_thread(_get_vector_store_id, vector_store_name)
+        store_files: Dict[str, Any] = {}
+        if vector_store_id:
+            try:
+                store_files = await asyncio.to_thread(_list_vector_store_files, vector_store_id)
+            except NotFoundError:
+                # The cached store was deleted elsewhere; list stores by name again in case
+                # another process has already recreated it, rather than creating a duplicate
+                _cache_vector_store_id(vector_store_name, None)
+                vector_store_id = await asyncio.to_thread(_get_vector_store_id, vector_store_name)
+                if vector_store_id:
+                    store_files = await asyncio.to_thread(_list_vector_store_files, vector_store_id)
         
-        # Create files with chunked content and upload to vector store
-        batch_size = 10  # Smaller batch size for chunked documents
-        total_upserted = 0
+        if not vector_store_id:
+            logger.info(f"Creating new vector store: {vector_store_name}")
+            target_store = await asyncio.to_thread(
+                get_openai_client().vector_stores.create,
+                name=vector_store_name,
+                metadata={"company": company_name, "document_type": "chunked_leads"}
+            )
+            vector_store_id = target_store.id
+            _cache_vector_store_id(vector_store_name, vector_store_id)
         
-        for i in range(0, len(documents), batch_size):
-            batch_documents = documents[i:i + batch_size]
-            
-            logger.info(f"Processing batch {i//batch_size + 1} ({len(batch_documents)} documents)")
-            
-            # Create file objects for this batch
-            file_objects = []
+        # Files that failed or were cancelled are submitted again
+        attached_file_ids = {
+            file_id for file_id, store_file in store_files.items()
+            if store_file.status in ("completed", "in_progress")
+        }
+        
+        # Uploads from previous runs that can be reattached if their content is unchanged
+        previous_files = await asyncio.to_thread(load_file_cache, company_name)
+        reusable_files = await asyncio.to_thread(_load_reusable_files, company_name)
+        current_files: Dict[str, Tuple[str, str]] = {}
+        # Documents whose file is attached to the store: unchanged, or in a completed batch
+        committed_files: Dict[str, Tuple[str, str]] = {}
+        
+        batch_queue: asyncio.Queue = asyncio.Queue()
+        for batch_num, batch_documents in enumerate(_split_document_batches(documents, batch_size), 1):
+            batch_queue.put_nowait((batch_num, batch_documents))
+        total_batches = batch_queue.qsize()
+        upload_slots = asyncio.Semaphore(UPLOAD_CONCURRENCY)
+        
+        async def batch_worker(async_client: AsyncOpenAI) -> int:
+            """Upload, submit and await queued batches until none are left; return documents upserted."""
+            upserted = 0
             
-            for doc in batch_documents:
-                try:
-                    # Create structured file content for vector store
-                    metadata = doc['metadata']
-                    file_content = f"""Company: {company_name}
-Assignee: {metadata.get('assignedTo', 'Unknown')}
-Chunk: {metadata.get('chunk_index', 0) + 1} of {metadata.get('total_chunks', 1)}
-Total Leads: {metadata.get('total_leads', 0)}
-
-{doc['text']}
-
----
-Metadata: {metadata}"""
-                    
-                    # Create a temporary file and upload
-                    with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as temp_file:
-                        temp_file.write(file_content)
-                        temp_file.flush()
-                        
-                        # Upload file to OpenAI
-                        with open(temp_file.name, 'rb') as f:
-                            file_obj = client.files.create(
-                                file=f,
-                                purpose="assistants"
-                            )
-                            file_objects.append(file_obj)
-                    
-                    # Clean up temp file
-                    import os
-                    os.unlink(temp_file.name)
-                    
-                except Exception as e:
-                    logger.warning(f"Error creating file for document {doc['id']}: {e}")
+            while not batch_queue.empty():
+                batch_num, batch_documents = batch_queue.get_nowait()
+                logger.info(f"Processing batch {batch_num}/{total_batches} ({len(batch_documents)} documents)")
+                
+                file_batch = await _upload_document_batch(
+                    async_client, company_name, vector_store_id, batch_documents,
+                    reusable_files, current_files, attached_file_ids, upload_slots
+                )
+                batch_files = {doc['id']: current_files[doc['id']] for doc in batch_documents if doc['id'] in current_files}
+                batch_unchanged = {
+                    doc_id: upload for doc_id, upload in batch_files.items() if upload[1] in attached_file_ids
+                }
+                committed_files.update(batch_unchanged)
+                upserted += len(batch_unchanged)
+                await _refresh_file_attributes(
+                    async_client, vector_store_id, batch_documents, batch_unchanged, store_files, upload_slots
+                )
+                if file_batch is None:
                     continue
-            
-            # Add files to vector store in a batch
-            if file_objects:
+                
                 try:
-                    file_batch = client.beta.vector_stores.file_batches.create(
-                        vector_store_id=target_store.id,
-                        file_ids=[f.id for f in file_objects]
-                    )
-                    
-                    # Wait for batch processing to complete
-                    max_wait = 180  # Increased wait time for chunked documents
-                    wait_time = 0
-                    
-                    while file_batch.status in ["in_progress", "queued"] and wait_time < max_wait:
-                        time.sleep(5)
-                        wait_time += 5
-                        file_batch = client.beta.vector_stores.file_batches.retrieve(
-                            vector_store_id=target_store.id,
-                            batch_id=file_batch.id
-                        )
-                        logger.info(f"Batch status: {file_batch.status}")
-                    
-                    if file_batch.status == "completed":
-                        total_upserted += len(batch_documents)
-                        logger.info(f"Successfully processed batch {i//batch_size + 1}")
-                    else:
-                        logger.warning(f"Batch {i//batch_size + 1} status: {file_batch.status}")
-                        # Still count as processed for now
-                        total_upserted += len(batch_documents)
-                        
+                    file_batch = await _wait_for_file_batch(async_client, vector_store_id, file_batch)
                 except Exception as e:
                     logger.warning(f"Error processing file batch: {e}")
                     continue
+                
+                if file_batch.status == "completed":
+                    logger.info(f"Successfully processed batch {batch_num}")
+                    committed_files.update(batch_files)
+                    upserted += len(batch_files) - len(batch_unchanged)
+                else:
+                    logger.warning(f"Batch {batch_num} status: {file_batch.status}")
             
-            # Small delay between batches
-            if i + batch_size < len(documents):
-                time.sleep(3)
+            return upserted
+        
+        async with _create_async_client() as async_client:
+            worker_counts = await asyncio.gather(*(
+                batch_worker(async_client) for _ in range(min(UPSERT_BATCH_WORKERS, total_batches))
+            ))
+        total_upserted = sum(worker_counts)
+        
+        reusable_file_ids = set(reusable_files.values())
+        reused = sum(1 for _, file_id in current_files.values() if file_id in reusable_file_ids)
+        logger.info(f"Reused {reused} unchanged uploads, uploaded {len(current_files) - reused} files")
+        
+        # Documents whose new file never reached a completed batch keep their previous file
+        document_ids = {doc['id'] for doc in documents}
+        kept_files = dict(committed_files)
+        for doc_id, previous in previous_files.items():
+            if doc_id in document_ids and doc_id not in kept_files:
+                kept_files[doc_id] = previous
+        
+        kept_file_ids = {file_id for _, file_id in kept_files.values()}
+        stale_file_ids = [file_id for file_id in store_files if file_id not in kept_file_ids]
+        if stale_file_ids:
+            logger.info(f"Detaching {len(stale_file_ids)} stale files from {vector_store_name}")
+            await asyncio.to_thread(_detach_files, vector_store_id, stale_file_ids)
+        await asyncio.to_thread(_update_file_cache, company_name, previous_files, kept_files)
         
         return {
             "upserted": total_upserted,
-            "vector_store_id": target_store.id,
+            "vector_store_id": vector_store_id,
             "message": f"Processed {total_upserted} chunked documents"
         }
         
     except Exception as e:
         logger.error(f"Error upserting chunked documents for {company_name}: {e}")
         raise
+    finally:
+        # Even a failed run may have changed the store's files
+        _invalidate_search_cache(company_name)
+
+def upsert_chunked_documents(
+    company_name: str, 
+    documents: List[Dict[str, Any]],
+    batch_size: int = FILE_BATCH_SIZE
+) -> dict:
+    """
+    Synchronous wrapper around upsert_chunked_documents_async for non-async callers.
+    
+    Args:
+        company_name: The name of the company
+        documents: List of chunked documents with keys: "id", "text", "metadata"
+        batch_size: Number of documents attached to the vector store per file batch
+        
+    Returns:
+        dict: Summary of the upsert operation
+    """
+    return asyncio.run(upsert_chunked_documents_async(company_name, documents, batch_size))
 
 # Keep the old function for backward compatibility during transition
 upsert_lead_documents = upsert_chunked_documents
 
-@backoff.on_exception(backoff.expo, Exception, max_tries=3, max_time=30)
 def delete_vectors_by_filter(company_name: str, assigned_to: str = None, assigned_to_id: str = None) -> dict:
     """
     Delete existing vectors for a company or specific assignedTo group.
@@ -248,27 +1123,38 @@ def delete_vectors_by_filter(company_name: str, assigned_to: str = None, assigne
         vector_store_name = getVectorStoreName(company_name)
         
         # Find vector store
-        vector_stores = client.beta.vector_stores.list()
-        target_store = None
+        vector_store_id = _get_vector_store_id(vector_store_name)
         
-        for store in vector_stores.data:
-            if store.name == vector_store_name:
-                target_store = store
-                break
-        
-        if not target_store:
+        if not vector_store_id:
             return {"deleted": 0, "message": f"No vector store found for {company_name}"}
         
         # If full refresh (no filters), delete the entire vector store and recreate
         if not assigned_to and not assigned_to_id:
-            client.beta.vector_stores.delete(target_store.id)
+            _delete_vector_store(vector_store_name, vector_store_id)
+            _invalidate_search_cache(company_name)
             logger.info(f"Deleted vector store for {company_name}")
             return {"deleted": "all", "message": f"Deleted entire vector store for {company_name}"}
         
-        # For filtered deletion, we would need to implement file-level deletion
-        # This is more complex with OpenAI's current API
-        logger.warning(f"Filtered deletion not yet implemented for {company_name}")
-        return {"deleted": 0, "message": "Filtered deletion not implemented"}
+        # Filtered deletion detaches the files tagged with the assignee (see FILE_ATTRIBUTE_KEYS)
+        filters = {}
+        if assigned_to:
+            filters["assignedTo"] = assigned_to
+        if assigned_to_id:
+            filters["assignedToId"] = assigned_to_id
+        try:
+            file_ids = _find_files_by_attributes(vector_store_id, filters)
+        except NotFoundError:
+            # The cached ID is stale; look the name up again in case the store was recreated
+            _cache_vector_store_id(vector_store_name, None)
+            vector_store_id = _get_vector_store_id(vector_store_name)
+            if not vector_store_id:
+                return {"deleted": 0, "message": f"No vector store found for {company_name}"}
+            file_ids = _find_files_by_attributes(vector_store_id, filters)
+        deleted = _detach_files(vector_store_id, file_ids)
+        if deleted:
+            _invalidate_search_cache(company_name)
+        logger.info(f"Deleted {deleted} files matching {filters} for {company_name}")
+        return {"deleted": deleted, "message": f"Deleted {deleted} files for {company_name}"}
         
     except Exception as e:
         logger.error(f"Error deleting vectors for {company_name}: {e}")
@@ -277,7 +1163,7 @@ def delete_vectors_by_filter(company_name: str, assigned_to: str = None, assigne
 def search_vector_store(company_name: str, query: str, top_k: int = 20) -> List[Dict[str, Any]]:
     """
     Search the vector store for semantically similar documents.
-    Uses a simple but reliable approach that avoids complex assistant threading.
+    Uses the vector store search endpoint, which returns ranked chunks in one call.
     
     Args:
         company_name: The name of the company
@@ -288,134 +1174,65 @@ def search_vector_store(company_name: str, query: str, top_k: int = 20) -> List[
         List[Dict[str, Any]]: List of search results with metadata and content
     """
     
+    cache_key = (company_name, query.strip().lower(), top_k)
+    cached_results = _search_cache.get(cache_key)
+    if cached_results is not None:
+        logger.info(f"Using cached search results for {company_name}")
+        return cached_results
+    
     try:
         vector_store_name = getVectorStoreName(company_name)
         
         # Find vector store
-        vector_stores = client.beta.vector_stores.list()
-        target_store = None
+        vector_store_id = _get_vector_store_id(vector_store_name)
         
-        for store in vector_stores.data:
-            if store.name == vector_store_name:
-                target_store = store
-                break
-        
-        if not target_store:
+        if not vector_store_id:
             logger.warning(f"No vector store found for {company_name}")
             return []
         
-        # Get files in vector store to ensure data exists
         try:
-            vector_store_files = client.beta.vector_stores.files.list(
-                vector_store_id=target_store.id,
+            results = get_openai_client().vector_stores.search(
+                vector_store_id=vector_store_id,
+                query=query,
+                max_num_results=min(top_k, MAX_SEARCH_RESULTS)
             )
-            
-            if not vector_store_files.data:
-                logger.warning(f"No files found in vector store for {company_name}")
-                return []
-            
-            logger.info(f"Found {len(vector_store_files.data)} files in vector store for {company_name}")
-            
-            # Use a very simple assistant approach with strict timeout
-            assistant = client.beta.assistants.create(
-                name=f"Search-{company_name}-{int(time.time())}",  # Unique name
-                instructions="Extract relevant lead information. Be brief and specific.",
-                model="gpt-4o-mini",
-                tools=[{"type": "file_search"}],
-                tool_resources={"file_search": {"vector_store_ids": [target_store.id]}}
-            )
-            
-            thread = None
-            try:
-                # Create thread and message
-                thread = client.beta.threads.create()
-                
-                client.beta.threads.messages.create(
-                    thread_id=thread.id,
-                    role="user",
-                    content=f"Search for: {query}"
-                )
-                
-                # Run with very short timeout
-                run = client.beta.threads.runs.create(
-                    thread_id=thread.id,
-                    assistant_id=assistant.id
-                )
-                
-                # Poll with aggressive timeout
-                max_attempts = 100
-                attempt = 0
-                
-                while attempt < max_attempts:
-                    run = client.beta.threads.runs.retrieve(thread_id=thread.id, run_id=run.id)
-                    
-                    if run.status == "completed":
-                        # Get response
-                        messages = client.beta.threads.messages.list(thread_id=thread.id)
-                        
-                        for message in messages.data:
-                            if message.role == "assistant":
-                                content_text = ""
-                                for content_block in message.content:
-                                    if hasattr(content_block, 'text'):
-                                        content_text += content_block.text.value
-                                
-                                if content_text:
-                                    return [{
-                                        "id": f"result_{company_name}",
-                                        "content": content_text,
-                                        "metadata": {
-                                            "companyName": company_name,
-                                            "searchQuery": query,
-                                            "resultType": "assistant_search",
-                                            "assignedTo": "Multiple",
-                                            "total_files": len(vector_store_files.data)
-                                        },
-                                        "score": 1.0
-                                    }]
-                                break
-                        break
-                    
-                    elif run.status in ["failed", "cancelled", "expired"]:
-                        logger.warning(f"Search run failed: {run.status}")
-                        break
-                    
-                    time.sleep(0.5)
-                    attempt += 1
-                
-                # If we get here, the search didn't complete in time
-                logger.warning(f"Search timed out after {max_attempts * 0.5}s")
-                
-            finally:
-                # Quick cleanup
-                if thread:
-                    try:
-                        client.beta.threads.delete(thread.id)
-                    except:
-                        pass
-                try:
-                    client.beta.assistants.delete(assistant.id)
-                except:
-                    pass
-            
+        except NotFoundError:
+            # The cached store was deleted elsewhere; look it up again next time
+            logger.warning(f"Vector store for {company_name} no longer exists")
+            _cache_vector_store_id(vector_store_name, None)
+            return []
+        except Exception as search_e:
+            logger.error(f"Vector store search failed for {company_name}: {search_e}")
             # Fallback: return indication that data exists
             return [{
                 "id": f"available_{company_name}",
-                "content": f"Lead data is available for {company_name} with {len(vector_store_files.data)} portfolio documents. The vector search is currently processing - please try again in a moment or rephrase your question.",
+                "content": f"Lead data is available for {company_name}. The vector search is currently processing - please try again in a moment or rephrase your question.",
                 "metadata": {
                     "companyName": company_name,
                     "searchQuery": query,
                     "resultType": "data_available",
-                    "available_documents": len(vector_store_files.data),
-                    "assignedTo": "Multiple assignees",
-                    "total_chunks": len(vector_store_files.data)
+                    "assignedTo": "Multiple assignees"
                 },
                 "score": 0.7
             }]
-            
-        except Exception as files_e:
-            logger.error(f"Error accessing files: {files_e}")
-            return []
+        
+        search_results = [
+            {
+                "id": result.file_id,
+                "content": "".join(part.text for part in result.content),
+                "metadata": {
+                    **(result.attributes or {}),
+                    "companyName": company_name,
+                    "filename": result.filename,
+                    "resultType": "vector_search"
+                },
+                "score": result.score
+            }
+            for result in results.data
+        ]
+        logger.info(f"Vector store search returned {len(search_results)} results for {company_name}")
+        _search_cache.set(cache_key, search_results)
+        return search_results
         
     except Exception as e:
         logger.error(f"Error in search for {company_name}: {e}")